@@ -0,0 +1,214 @@
+"""
+Generates the reports for several workbooks, courses and semesters in one run. The
+reports of all entries in a manifest are put in a single work queue, which is
+processed by a shared pool of worker processes.
+
+The manifest is a JSON file with a list of entries such as
+
+    [{"workbook": "FAG123_H2019_vurdering.xlsx", "course": "FAG123",
+      "semester": "H2019", "activities": [3, 4]}]
+
+or a csv file with the columns workbook, course, semester and activities, where the
+activities are separated by spaces. All activities of a workbook are included if
+activities is left out or empty.
+
+    python batch_reports.py manifest.json --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from evaluation_rubric import Evaluator, export_report_in_worker
+
+
+def read_manifest(filename):
+    """ Reads a manifest (see the module docstring) as a list of dictionaries. """
+    if os.path.splitext(filename)[1].lower() == ".csv":
+        with open(filename, newline = "", encoding = "utf-8") as f:
+            entries = list(csv.DictReader(f))
+        for entry in entries:
+            entry["activities"] = [int(x) for x in (entry.get("activities") or "").split()]
+    else:
+        with open(filename, encoding = "utf-8") as f:
+            entries = json.load(f)
+
+    for entry in entries:
+        missing = [key for key in ["workbook", "course", "semester"] if not entry.get(key)]
+        if missing:
+            raise AssertionError(f"Manifest entry {entry} is missing {missing}.")
+    return entries
+
+
+def get_evaluator(evaluators, workbook, course, semester, cache_dir = None):
+    """
+    Returns the evaluator for a workbook, course and semester from evaluators (a
+    dictionary), creating it if needed. Evaluators for the same workbook share the
+    parsed activities.
+    """
+    key = (os.path.abspath(workbook), course, semester)
+    if key not in evaluators:
+        same_workbook = [evaluator for (path, c, s), evaluator in evaluators.items()
+                         if path == key[0]]
+        if same_workbook:
+            evaluators[key] = same_workbook[0].copy_for_course(course, semester)
+        else:
+            evaluators[key] = Evaluator(workbook, course, semester, cache_dir = cache_dir)
+    return evaluators[key]
+
+
+def interleave(queues):
+    """ Takes one item from each queue in turn, until all queues are empty. """
+    queues = [list(queue) for queue in queues]
+    items = []
+    for i in range(max([len(queue) for queue in queues] + [0])):
+        items += [queue[i] for queue in queues if i < len(queue)]
+    return items
+
+
+def generate_reports_for_manifest(entries, workers = 1, cache_dir = None, force = False,
+                                  max_pending = None, **kwargs):
+    """
+    Generates the reports for all entries of a manifest (see read_manifest). The
+    markdown of all reports is generated in this process, and the exports are
+    distributed over a pool of worker processes that is shared by all entries. The
+    reports of the different activities are interleaved in the queue, so that large
+    courses don't hold up small ones. At most max_pending reports (2 * workers by
+    default) are generated ahead of the workers, so that memory use doesn't grow with
+    the size of the manifest. Other arguments are passed to generate_report.
+
+    Returns a summary with one dictionary per activity, with the numbers of reports
+    that were generated and up to date, and the students that failed.
+    """
+    evaluators = {}
+    jobs = []
+    for entry in entries:
+        evaluator = get_evaluator(evaluators, entry["workbook"], entry["course"],
+                                  entry["semester"], cache_dir = cache_dir)
+        for activity_number in (entry.get("activities") or evaluator.activity_numbers):
+            manifest, student_hashes, pending, failed = \
+                evaluator.plan_reports(activity_number, force = force, **kwargs)
+            jobs.append({"evaluator": evaluator, "activity_number": activity_number,
+                         "manifest": manifest, "student_hashes": student_hashes,
+                         "pending": pending, "failed": failed, "exported": {},
+                         "up_to_date": len(evaluator.get_students(activity_number)) - \
+                             len(pending) - len(failed)})
+
+    formats = jobs[0]["evaluator"].get_export_formats(kwargs.get("formats"),
+                                                      kwargs.get("remove_temp_files", True)) \
+        if jobs else None
+    queue = interleave([[(job, student) for student in job["pending"]] for job in jobs])
+    max_pending = max_pending or 2 * workers
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+
+        def collect(future):
+            job, student, fn_student = futures.pop(future)
+            str_entry = get_entry_name(job)
+            try:
+                job["evaluator"].timer.merge(future.result())
+                job["exported"][student] = fn_student + "." + formats[0]
+                print(f"SUCCESS: generated report for {student} ({str_entry})")
+            except Exception as e:
+                print(f"Export failed for {student} ({str_entry})")
+                print(e)
+                job["failed"].append(student)
+
+        futures = {}
+        for job, student in queue:
+            while len(futures) >= max_pending:
+                done, not_done = wait(futures, return_when = FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+
+            evaluator, activity_number = job["evaluator"], job["activity_number"]
+            try:
+                report = evaluator.generate_report(student, activity_number,
+                                                   **dict(kwargs, export = False))
+            except Exception as e:
+                print(f"REPORT GENERATION FAILED for {student} ({get_entry_name(job)})")
+                print(e)
+                job["failed"].append(student)
+                continue
+            fn_student, profile = evaluator.prepare_report_export(
+                student, activity_number, temp = kwargs.get("temp", False),
+                timestamp = kwargs.get("timestamp", True), toc = kwargs.get("toc", False))
+            future = pool.submit(export_report_in_worker, report, fn_student,
+                                 profile, formats, evaluator.timer.enabled, student)
+            futures[future] = (job, student, fn_student)
+
+        while futures:
+            done, not_done = wait(futures, return_when = FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+
+    summary = []
+    for job in jobs:
+        failed = job["evaluator"].finish_reports(job["activity_number"], job["manifest"],
+                                                 job["student_hashes"], job["exported"],
+                                                 job["failed"], temp = kwargs.get("temp", False))
+        summary.append({"workbook": job["evaluator"].filename,
+                        "course": job["evaluator"].str_course_code,
+                        "semester": job["evaluator"].str_course_semester,
+                        "activity": job["activity_number"],
+                        "generated": len(job["exported"]),
+                        "up_to_date": job["up_to_date"],
+                        "failed": failed})
+    return summary
+
+
+def get_entry_name(job):
+    evaluator = job["evaluator"]
+    return evaluator.str_course_code + " " + evaluator.str_course_semester + ", " + \
+        evaluator.str_activity.lower() + " " + str(job["activity_number"])
+
+
+def format_summary(summary):
+    """ Formats the summary returned by generate_reports_for_manifest as a table. """
+    lines = [f"{'Course':<10}{'Semester':<10}{'Activity':>9}{'Generated':>11}{'Up to date':>12}{'Failed':>8}"]
+    for x in summary:
+        lines.append(f"{x['course']:<10}{x['semester']:<10}{x['activity']:>9}{x['generated']:>11}" + \
+                     f"{x['up_to_date']:>12}{len(x['failed']):>8}")
+    lines.append(f"{'Total':<29}{sum(x['generated'] for x in summary):>11}" + \
+                 f"{sum(x['up_to_date'] for x in summary):>12}" + \
+                 f"{sum(len(x['failed']) for x in summary):>8}")
+
+    failed = [(x, student) for x in summary for student in x["failed"]]
+    if failed:
+        lines.append("Reports could not be generated for the following students:")
+        lines += [f"  {x['course']} {x['semester']}, activity {x['activity']}: {student}"
+                  for x, student in failed]
+    return "\n".join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help = "JSON or csv file listing the workbooks, courses, semesters and activities.")
+    parser.add_argument("--workers", type = int, default = 1,
+                        help = "Number of worker processes shared by all reports.")
+    parser.add_argument("--max-pending", type = int, default = None,
+                        help = "Number of reports to generate ahead of the workers (2 * workers by default).")
+    parser.add_argument("--cache-dir", default = None,
+                        help = "Folder in which to cache the parsed workbooks between runs.")
+    parser.add_argument("--formats", nargs = "+", default = ["pdf"], choices = ["pdf", "html", "md"],
+                        help = "Formats to export the reports to.")
+    parser.add_argument("--force", action = "store_true",
+                        help = "Regenerate all reports, also those that are up to date.")
+    parser.add_argument("--summary", default = None,
+                        help = "Write the summary to this JSON file.")
+    args = parser.parse_args(argv)
+
+    summary = generate_reports_for_manifest(read_manifest(args.manifest), workers = args.workers,
+                                            cache_dir = args.cache_dir, force = args.force,
+                                            max_pending = args.max_pending,
+                                            formats = args.formats)
+    print()
+    print(format_summary(summary))
+    if args.summary is not None:
+        with open(args.summary, "w", encoding = "utf-8") as f:
+            json.dump(summary, f, indent = 2, ensure_ascii = False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Compares exporting the reports for an activity one pandoc/xelatex run per student 
+with exporting them in a single batch LaTeX run. Requires pandoc, xelatex and pypdf.
+
+    python benchmarks/bench_batch_latex.py --students 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from evaluation_rubric import Evaluator
+from synthetic_workbook import make_workbook
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type = int, default = 200)
+    parser.add_argument("--criteria", type = int, default = 9)
+    args = parser.parse_args(argv)
+    
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = make_workbook(os.path.join(tmpdir, "benchmark.xlsx"), 
+                                 n_criteria = args.criteria, n_students = args.students)
+        os.chdir(tmpdir)
+        try:
+            evaluator = Evaluator(filename, "FAG123", "H2019")
+            
+            timings = {}
+            for label, batch in [("per student", False), ("batch", True)]:
+                t0 = perf_counter()
+                # force, as the reports of the first run would otherwise be up to date
+                evaluator.generate_reports(1, batch = batch, timestamp = False, force = True)
+                timings[label] = perf_counter() - t0
+        finally:
+            os.chdir(cwd)
+    
+    print(f"\n{args.students} students, {args.criteria} criteria")
+    for label, seconds in timings.items():
+        print(f"{label:>12}: {seconds:8.2f} s ({seconds / args.students:.3f} s per student)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Times the import of evaluation_rubric in fresh interpreters, and lists the modules
+that take longest to import (from python -X importtime). pypandoc and markdown are
+only imported when a report is exported to pdf or html, so they should not show up.
+Also times answering rubric_cli.py --help, which shouldn't import pandas at all.
+
+    python benchmarks/bench_import.py --repeat 10 --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+deferred = ["pypandoc", "markdown", "asyncio", "cProfile"]
+
+
+def run_import():
+    """ Imports evaluation_rubric in a new interpreter. Returns the import times (in us) by module and the loaded modules. """
+    code = "import sys; import evaluation_rubric; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd = root,
+                            capture_output = True, text = True, check = True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and not line.endswith("package"):
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            times[name.strip()] = int(cumulative_us)
+    return times, result.stdout.split()
+
+
+def run_help():
+    """ Runs rubric_cli.py --help in a new interpreter. Returns the seconds it took. """
+    t0 = perf_counter()
+    subprocess.run([sys.executable, os.path.join(root, "rubric_cli.py"), "--help"], cwd = root,
+                   capture_output = True, check = True)
+    return perf_counter() - t0
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type = int, default = 5,
+                        help = "Number of runs. The best time is reported.")
+    parser.add_argument("--top", type = int, default = 10,
+                        help = "Number of modules to list.")
+    args = parser.parse_args(argv)
+
+    runs = [run_import() for i in range(args.repeat)]
+    best = min(runs, key = lambda run: run[0]["evaluation_rubric"])
+    times, modules = best
+
+    print(f"import evaluation_rubric: {times['evaluation_rubric'] / 1e3:.1f} ms (best of {args.repeat})")
+    print(f"rubric_cli.py --help: {min(run_help() for i in range(args.repeat)) * 1e3:.1f} ms " + \
+          "(including starting the interpreter)")
+    print(f"\n{'module':<30} {'cumulative':>12}")
+    top_level = {name: t for name, t in times.items() if "." not in name}
+    for name, t in sorted(top_level.items(), key = lambda x: -x[1])[:args.top]:
+        print(f"{name:<30} {t / 1e3:>10.1f}ms")
+
+    loaded = [name for name in deferred if name in modules]
+    if loaded:
+        print("\nWARNING: imported although they should be deferred: " + ", ".join(loaded))
+
+
+if __name__ == "__main__":
+    main()
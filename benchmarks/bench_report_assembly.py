@@ -0,0 +1,49 @@
+"""
+Times the generation of the markdown reports (without exporting them) for rubrics
+with an increasing number of criteria. With compiled report templates, the time per
+report should grow linearly with the number of criteria.
+
+    python benchmarks/bench_report_assembly.py --students 200 --criteria 10 50 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from evaluation_rubric import Evaluator
+from synthetic_workbook import make_workbook
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type = int, default = 200)
+    parser.add_argument("--criteria", type = int, nargs = "+", default = [10, 50, 200])
+    args = parser.parse_args(argv)
+
+    print(f"{'criteria':>8} {'compile':>10} {'reports':>10} {'per report':>12} {'per criterion':>14}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_criteria in args.criteria:
+            filename = make_workbook(os.path.join(tmpdir, f"benchmark_{n_criteria}.xlsx"),
+                                     n_criteria = n_criteria, n_students = args.students)
+            evaluator = Evaluator(filename, "FAG123", "H2019")
+            students = evaluator.get_students(1)
+
+            # Parsing the workbook and compiling the model and template happen once per activity
+            t0 = perf_counter()
+            evaluator.get_report_template(1, include_scores = True)
+            t1 = perf_counter()
+            for student in students:
+                evaluator.generate_report(student, 1, export = False, include_scores = True).markdown
+            t2 = perf_counter()
+
+            per_report = (t2 - t1) / len(students)
+            print(f"{n_criteria:>8} {t1 - t0:>9.3f}s {t2 - t1:>9.3f}s {per_report * 1e3:>10.3f}ms " + \
+                  f"{per_report / n_criteria * 1e6:>12.2f}us")
+
+
+if __name__ == "__main__":
+    main()
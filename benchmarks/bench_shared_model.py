@@ -0,0 +1,84 @@
+"""
+Compares sending the compiled ActivityModel of an activity to worker processes with
+sending a SharedActivityModel (see Evaluator.share_activity_model), for cohorts of
+increasing size. For each, prints the number of bytes pickled per worker and the
+private (anonymous) memory of a worker after it has received the model, and for the
+shared model after it has also generated all reports. The memory is read from
+/proc/self/status, so it is only measured on Linux.
+
+    python benchmarks/bench_shared_model.py --students 100 1000 5000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from evaluation_rubric import Evaluator
+from synthetic_workbook import make_workbook
+
+
+def get_private_memory():
+    """ The resident anonymous memory of this process in bytes, or None if it is not available. """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def receive_model(model):
+    return get_private_memory()
+
+
+def render_reports(shared):
+    for student in shared.students:
+        shared.generate_report(student).markdown
+    return get_private_memory()
+
+
+def format_memory(x):
+    return f" {x / 2**20:>9.1f}MB" if x is not None else f" {'-':>11}"
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type = int, nargs = "+", default = [100, 1000, 5000])
+    parser.add_argument("--criteria", type = int, default = 30)
+    parser.add_argument("--workers", type = int, default = 2)
+    args = parser.parse_args(argv)
+
+    # Fresh interpreters, so that the workers don't start with a copy of this process
+    context = multiprocessing.get_context("spawn")
+    print(f"{'students':>8} {'model':>12} {'shared':>12} {'model mem':>12} {'shared mem':>12} {'rendered':>12}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_students in args.students:
+            filename = make_workbook(os.path.join(tmpdir, f"benchmark_{n_students}.xlsx"),
+                                     n_criteria = args.criteria, n_students = n_students)
+            evaluator = Evaluator(filename, "FAG123", "H2019")
+            model = evaluator.get_activity_model(1)
+            with evaluator.share_activity_model(1, directory = tmpdir) as shared:
+                with ProcessPoolExecutor(max_workers = args.workers, mp_context = context) as pool:
+                    # Warm up the workers, so that the imports aren't counted
+                    list(pool.map(receive_model, [None] * args.workers))
+                    model_memory = max(pool.map(receive_model, [model] * args.workers))
+                with ProcessPoolExecutor(max_workers = args.workers, mp_context = context) as pool:
+                    list(pool.map(receive_model, [None] * args.workers))
+                    shared_memory = max(pool.map(receive_model, [shared] * args.workers))
+                    rendered_memory = max(pool.map(render_reports, [shared] * args.workers))
+
+                print(f"{n_students:>8} {len(pickle.dumps(model)):>12} {len(pickle.dumps(shared)):>12}" + \
+                      format_memory(model_memory) + format_memory(shared_memory) + \
+                      format_memory(rendered_memory))
+
+
+if __name__ == "__main__":
+    main()
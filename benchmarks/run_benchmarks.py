@@ -0,0 +1,142 @@
+"""
+Times each stage of report generation on a synthetic workbook: loading the workbook,
+compiling each activity, generating the markdown reports and rendering them to pdf.
+The timings are written to a JSON file, so that they can be compared between versions
+with --baseline. Use --markdown-only to skip the pdf rendering, which needs pandoc
+and xelatex.
+
+    python benchmarks/run_benchmarks.py --activities 2 --criteria 50 --students 200 --output results.json
+    python benchmarks/run_benchmarks.py --markdown-only --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, strftime, gmtime
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from evaluation_rubric import Evaluator
+from synthetic_workbook import make_workbook
+
+stages = ["load", "compile", "markdown", "pdf"]
+
+
+def run_stages(filename, markdown_only = False):
+    """ Runs all stages once on a workbook. Returns the seconds spent in each stage. """
+    timings = {}
+
+    t0 = perf_counter()
+    evaluator = Evaluator(filename, "FAG123", "H2019")
+    for activity_number in evaluator.activity_numbers:
+        evaluator.get_activity(activity_number)
+    timings["load"] = perf_counter() - t0
+
+    t0 = perf_counter()
+    for activity_number in evaluator.activity_numbers:
+        evaluator.get_activity_model(activity_number)
+        evaluator.get_report_template(activity_number)
+    timings["compile"] = perf_counter() - t0
+
+    t0 = perf_counter()
+    reports = []
+    for activity_number in evaluator.activity_numbers:
+        for student in evaluator.get_students(activity_number):
+            reports.append((student, activity_number,
+                            evaluator.generate_report(student, activity_number, export = False).markdown))
+    timings["markdown"] = perf_counter() - t0
+
+    if not markdown_only:
+        t0 = perf_counter()
+        for student, activity_number, str_report in reports:
+            evaluator.write_report_to_file(str_report, student, activity_number, timestamp = False)
+        timings["pdf"] = perf_counter() - t0
+    return timings
+
+
+def get_version():
+    """ The git commit of the evaluated code, if available. """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__)),
+                              text = True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_comparison(results, baseline):
+    """ Prints the best time of each stage next to the time in a baseline results file. """
+    print(f"\n{'stage':>10} {'baseline':>10} {'current':>10} {'ratio':>8}")
+    for stage in stages:
+        if stage in results["best"] and stage in baseline["best"]:
+            old, new = baseline["best"][stage], results["best"][stage]
+            print(f"{stage:>10} {old:>9.3f}s {new:>9.3f}s {new / old:>7.2f}x")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--activities", type = int, default = 1)
+    parser.add_argument("--criteria", type = int, default = 9)
+    parser.add_argument("--students", type = int, default = 30)
+    parser.add_argument("--repeat", type = int, default = 3,
+                        help = "Number of runs. The best time of each stage is reported.")
+    parser.add_argument("--markdown-only", action = "store_true",
+                        help = "Skip rendering the reports to pdf (no TeX needed).")
+    parser.add_argument("--output", default = "benchmark_results.json",
+                        help = "JSON file to write the results to.")
+    parser.add_argument("--baseline", default = None,
+                        help = "JSON file with earlier results to compare with.")
+    args = parser.parse_args(argv)
+
+    markdown_only = args.markdown_only
+    if not markdown_only and shutil.which("xelatex") is None:
+        print("xelatex was not found, so only the markdown reports are benchmarked.")
+        markdown_only = True
+
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = make_workbook(os.path.join(tmpdir, "benchmark.xlsx"),
+                                 n_activities = args.activities,
+                                 n_criteria = args.criteria, n_students = args.students)
+        # Reports are written to the working directory
+        os.chdir(tmpdir)
+        try:
+            for i in range(args.repeat):
+                runs.append(run_stages(filename, markdown_only = markdown_only))
+        finally:
+            os.chdir(cwd)
+
+    results = {
+        "version": get_version(),
+        "date": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"activities": args.activities, "criteria": args.criteria,
+                       "students": args.students, "markdown_only": markdown_only},
+        "runs": runs,
+        "best": {stage: min(run[stage] for run in runs) for stage in stages if stage in runs[0]}}
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent = 2)
+
+    n_reports = args.activities * args.students
+    print(f"{args.activities} activities, {args.criteria} criteria, {args.students} students")
+    for stage, seconds in results["best"].items():
+        print(f"{stage:>10}: {seconds:8.3f} s ({seconds / n_reports * 1e3:.3f} ms per report)")
+    print("Results written to " + output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Generates synthetic evaluation rubric workbooks in the layout expected by 
+evaluation_rubric.Evaluator, so that performance can be measured on classes and 
+rubrics of any size without using real student data.
+"""
+import random
+from openpyxl import Workbook
+
+str_title = "Vurdering av måloppnåelse (bare før inn 1, 2 eller 3 poeng - vekting skjer senere)"
+str_commentsrow = "Spesifikke kommentarer til hvert punkt"
+levels = ["Lav måloppnåelse", "Middels måloppnåelse", "Høy måloppnåelse"]
+scores = [1, 1.5, 2, 2.5, 3]
+
+
+def make_rubric_rows(n_criteria, n_categories):
+    """ Rows of the first nine columns (criteria and generic comments) of a rubric. """
+    rows = []
+    for i in range(n_criteria):
+        category = "Kategori " + str(i % n_categories + 1)
+        criterion_type = "Type " + str(i % 3 + 1)
+        criterion = "Kriterium " + str(i + 1)
+        descriptions = ["Beskrivelse av " + level.split()[0].lower() + " måloppnåelse på " + \
+                        criterion.lower() + "." for level in levels]
+        rows.append([category, criterion_type, criterion] + descriptions + descriptions)
+    return rows
+
+
+def make_students(n_students):
+    return ["Student" + str(i + 1) + ", Syntetisk" for i in range(n_students)]
+
+
+def add_rubric_sheet(wb, activity_number, n_criteria, n_students, n_categories = 5, 
+                     comment_fraction = 0.3, rng = None):
+    """ Adds an 'Aktivitet N, vurderingsrubrikk' sheet to the workbook. """
+    rng = rng or random.Random(activity_number)
+    ws = wb.create_sheet("Aktivitet " + str(activity_number) + ", vurderingsrubrikk")
+    students = make_students(n_students)
+    rubric_rows = make_rubric_rows(n_criteria, n_categories)
+    
+    ws.append([str_title])
+    ws.append([None] * 6 + ["Standardkommentar"] * 3)
+    ws.append(["Kategori", "Kriterietype", "Vurderingskriterium", 
+               "(1 poeng)", "(2 poeng)", "(3 poeng)"] + levels + students)
+    
+    # Points section
+    for row in rubric_rows:
+        ws.append(row + [rng.choice(scores) for _ in students])
+    
+    # Comments section, separated from the points by an empty row
+    ws.append([])
+    ws.append([str_commentsrow])
+    ws.append(["Kategori", None, "Tema"] + levels + [None] * 3 + students)
+    for row in rubric_rows:
+        ws.append(row + ["Kommentar til " + row[2].lower() + "." 
+                         if rng.random() < comment_fraction else None for _ in students])
+    return ws
+
+
+def make_workbook(filename, n_activities = 1, n_criteria = 9, n_students = 30, 
+                  n_categories = 5, seed = 0):
+    """ 
+    Writes a synthetic rubric workbook with activities numbered 1, ..., n_activities 
+    to filename. Returns the filename.
+    """
+    rng = random.Random(seed)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for activity_number in range(1, n_activities + 1):
+        add_rubric_sheet(wb, activity_number, n_criteria, n_students, 
+                         n_categories = n_categories, rng = rng)
+    wb.save(filename)
+    return filename
@@ -1,20 +1,57 @@
 import sys
 import pandas as pd
 import re
-import markdown
 import numpy as np
-import pypandoc
-import numbers
 import codecs
 import os
-import math
-from time import gmtime, strftime
+from time import gmtime, strftime, sleep, perf_counter, process_time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashlib
+import json
+import glob
+import pickle
+import shutil
+import subprocess
+import tempfile
+import signal
+import zipfile
+from xml.etree import ElementTree
+import contextlib
+import copy
+import weakref
+import csv
+import io
 
 class Evaluator():
-    def __init__(self, filename, str_course_code, str_course_semester):
-        """ Evaluator instances must be given a filename from which data are to be read. """
+    def __init__(self, filename, str_course_code, str_course_semester, cache_dir = None, 
+                 timing = False, secondary_filenames = None):
+        """ 
+        Evaluator instances must be given a filename from which data are to be read. 
+        Only the sheet names are read when the instance is created. The rubric of each 
+        activity is parsed the first time it is used, and then kept in memory.
+        
+        If cache_dir is given, the parsed rubrics are cached in that folder, and later 
+        instances read from the cache instead of parsing the workbook as long as the 
+        workbook is unchanged.
+        
+        If timing = True, the time spent in each stage of report generation is recorded 
+        in self.timer (see Timer), and summarised at the end of generate_reports.
+        
+        secondary_filenames are copies of the workbook filled in by other graders, for 
+        other students. The students in each rubric sheet of these workbooks are added 
+        to the students in the same sheet of the main workbook (see 
+        merge_student_columns).
+        """
+        self.timer = Timer(enabled = timing)
         self.filename = filename
-        self.xls_file = pd.ExcelFile(filename)
+        self.secondary_filenames = list(secondary_filenames or [])
+        self.secondary_workbooks = {}
+        self.cache_dir = cache_dir
+        self.workbook = None
+        self.workbook_key = None
+        self.activity_cache = {}
+        self.activity_models = {}
+        self.report_templates = {}
         self.ncols_criteria = 9 # how many columns in each activity is to be treated as evaluation criteria?
         self.str_activity = "Aktivitet"
         self.str_rubric = "vurderingsrubrikk"
@@ -25,15 +62,15 @@ class Evaluator():
         self.str_course_semester = str_course_semester
         self.str_commentsrow = 'Spesifikke kommentarer til hvert punkt'
         self.str_category = 'Kategori'
-        self.sheet_names = pd.ExcelFile(filename).sheet_names
+        self.sheet_names = self.find_sheet_names()
         self.rubric_sheetnames = self.find_evaluation_rubric_sheetnames()
         self.rubric_sheetidxs = self.find_evaluation_rubric_sheetname_idxs()
         self.activity_numbers = self.find_activity_numbers()
-        self.rubrics = self.find_rubrics()
-        self.comments_rows = self.find_comments_rows()
-        self.comments = self.find_comments()
-        self.points = self.find_points()
-        self.criteria_colnames = [self.find_criteria_colnames(activity_number) for activity_number in self.activity_numbers]
+        self.rubrics = ActivityData(self, "rubric")
+        self.comments_rows = ActivityData(self, "comments_row")
+        self.comments = ActivityData(self, "comments")
+        self.points = ActivityData(self, "points")
+        self.criteria_colnames = ActivityData(self, "criteria_colnames")
         self.achievement_level_low = "Lav måloppnåelse"
         self.achievement_level_mid = "Middels måloppnåelse"
         self.achievement_level_hi = "Høy måloppnåelse"
@@ -41,25 +78,382 @@ class Evaluator():
         self.str_combine_achievement_levels_single = ""#"Score: "#"På dette vurderingskriteriet oppnår du "
         self.str_combine_achievement_levels_start = ""#"Score"#"På dette vurderingskriteriet oppnår du "
         self.str_combine_achievement_levels_mid = "-"
+        self.min_score = 0
+        self.max_score = 3
+        self.colors = ["Brown", "Red", "RedOrange", "Orange", "YellowOrange", "Green", "Aquamarine"]
         self.str_tempdir = "tmp"
         self.pandoc_args = ['--mathjax', '-V', 'geometry:margin=2.5cm']
+        config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Config")
+        self.fn_header = os.path.join(config_dir, "header.tex")
+        self.fn_after_body = os.path.join(config_dir, "after-body.tex")
+        self.fn_manifest = 'build_manifest.json'
+        self.export_formats = ("pdf", "html", "md")
+        self.created_dirs = set()
+        self.render_profiles = {}
         self.str_summary = "Oppsummering"
         self.str_feedback = "Detaljert tilbakemelding"
         self.str_reason_for_lowerscore = "Avvik fra høyeste måloppnåelse og/eller andre kommentarer"
         self.str_points = "poeng"
         self.str_table_score = "Score"
         self.str_table_normalised_score = "Vektet score"
+        self.str_cohort_report = "Kullrapport"
+        self.str_student = "Student"
+        self.str_count = "Antall"
+        self.str_mean = "Gjennomsnitt"
+        self.str_median = "Median"
+        self.str_percentile = "persentil"
+        self.str_min = "Min"
+        self.str_max = "Maks"
         self.str_intermediate_performance = "På dette vurderingskriteret har du prestert et sted mellom følgende måloppnåelsebeskrivelser:"
         self.str_performance = "Følgende måloppnåelsebeskrivelse er omtrent beskrivende for prestasjonen din på dette vurderingskriteriet:"
 
 
+    def copy_for_course(self, str_course_code, str_course_semester):
+        """ 
+        Returns an evaluator for the same workbook, but another course code and/or 
+        semester. The parsed activities are shared with this evaluator, so the 
+        workbook is only parsed once.
+        """
+        evaluator = copy.copy(self)
+        evaluator.str_course_code = str_course_code
+        evaluator.str_course_semester = str_course_semester
+        # The report templates contain the course code and semester
+        evaluator.report_templates = {}
+        evaluator.rubrics = ActivityData(evaluator, "rubric")
+        evaluator.comments_rows = ActivityData(evaluator, "comments_row")
+        evaluator.comments = ActivityData(evaluator, "comments")
+        evaluator.points = ActivityData(evaluator, "points")
+        evaluator.criteria_colnames = ActivityData(evaluator, "criteria_colnames")
+        return evaluator
+    
+    @property
+    def xls_file(self):
+        """ The workbook, which is only opened when it is first needed. """
+        if self.workbook is None:
+            with self.timer.span("open workbook"):
+                self.workbook = pd.ExcelFile(self.filename)
+        return self.workbook
+    
+    def get_workbook_key(self):
+        """ 
+        Identifies the current version of the workbook by its path, size, modification 
+        time and a hash of its contents, together with the settings used to parse it.
+        """
+        stat = os.stat(self.filename)
+        h = hashlib.sha256()
+        with open(self.filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return {"path": os.path.abspath(self.filename), 
+                "size": stat.st_size, 
+                "mtime": stat.st_mtime_ns, 
+                "sha256": h.hexdigest(), 
+                "settings": [self.ncols_criteria, self.str_activity, self.str_rubric, 
+                             self.str_commentsrow, self.str_category, 
+                             self.str_criterion_type, self.str_criterion_theme], 
+                "secondary": [self.get_file_key(fn) for fn in self.secondary_filenames]}
+    
+    def get_file_key(self, filename):
+        """ Identifies the current version of a secondary workbook. """
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return [os.path.abspath(filename), h.hexdigest()]
+    
+    def get_workbook_cache_filename(self, activity_number = None):
+        """ 
+        Cache entries are named after the workbook path, so each workbook has at most 
+        one entry for its sheet names and one for each activity.
+        """
+        str_path_hash = hashlib.sha256(os.path.abspath(self.filename).encode("utf-8")).hexdigest()
+        fn = os.path.splitext(os.path.basename(self.filename))[0] + "_" + str_path_hash[:16]
+        if activity_number is not None:
+            fn += "_" + self.str_activity + "_" + str(activity_number)
+        return os.path.join(self.cache_dir, fn + ".pkl")
+    
+    def read_workbook_cache(self, activity_number = None):
+        """ 
+        Returns the cached data for an activity (or the sheet names of the workbook if 
+        activity_number is None), or None if nothing is cached or the workbook has 
+        changed since it was cached.
+        """
+        fn = self.get_workbook_cache_filename(activity_number)
+        if not os.path.isfile(fn):
+            return None
+        try:
+            with self.timer.span("read cache"), open(fn, "rb") as f:
+                entry = pickle.load(f)
+        except Exception as e:
+            print(f"Could not read cache file {fn}, parsing the workbook instead.")
+            print(e)
+            return None
+        
+        if self.workbook_key is None:
+            # Compare size and modification time first, so that the contents are only 
+            # hashed if the file looks unchanged.
+            stat = os.stat(self.filename)
+            if entry["key"]["size"] != stat.st_size or entry["key"]["mtime"] != stat.st_mtime_ns:
+                return None
+            self.workbook_key = self.get_workbook_key()
+        
+        if entry["key"] != self.workbook_key:
+            return None
+        return entry["data"]
+    
+    def write_workbook_cache(self, data, activity_number = None):
+        """ Writes the sheet names, or the parsed data of an activity, to the cache. """
+        fn = self.get_workbook_cache_filename(activity_number)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self.workbook_key is None:
+            self.workbook_key = self.get_workbook_key()
+        with open(fn + ".tmp", "wb") as f:
+            pickle.dump({"key": self.workbook_key, "data": data}, f, 
+                        protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(fn + ".tmp", fn)
+    
+    def find_sheet_names(self):
+        """ Finds the sheet names of the workbook, from the cache if possible. """
+        if self.cache_dir is not None:
+            sheet_names = self.read_workbook_cache()
+            if sheet_names is not None:
+                return sheet_names
+        
+        sheet_names = self.xls_file.sheet_names
+        if self.cache_dir is not None:
+            self.write_workbook_cache(sheet_names)
+        return sheet_names
+    
+    def get_activity(self, activity_number):
+        """ 
+        Returns the parsed rubric, comments and points of an activity. The activity 
+        is parsed (or read from the cache) the first time it is requested, and kept 
+        in memory afterwards.
+        """
+        if activity_number not in self.activity_cache:
+            self.validate_activity_number(activity_number)
+            
+            activity = None
+            if self.cache_dir is not None:
+                activity = self.read_workbook_cache(activity_number)
+            if activity is None:
+                activity = self.parse_activity(activity_number)
+                if self.cache_dir is not None:
+                    self.write_workbook_cache(activity, activity_number)
+            self.activity_cache[activity_number] = activity
+            
+        return self.activity_cache[activity_number]
+    
+    def parse_activity(self, activity_number, skiprows = 2, nrows_separating_comments = 2):
+        """ Parses the rubric sheet of an activity, and splits it into sorted points and comments. """
+        sheetname = self.rubric_sheetnames[self.activity_numbers.index(activity_number)]
+        with self.timer.span("parse sheet"):
+            rubric = self.xls_file.parse(sheetname, skiprows = skiprows)
+        
+        merge_conflicts = []
+        for fn in self.secondary_filenames:
+            with self.timer.span("merge sheet"):
+                rubric = self.merge_student_columns(rubric, fn, sheetname, merge_conflicts, 
+                                                    skiprows = skiprows)
+        comments_row = self.locate_comments_row(rubric, skiprows = skiprows)
+        
+        with self.timer.span("sort"):
+            comments = rubric.iloc[comments_row:]
+            comments = comments.sort_values(by = [self.str_category, self.str_criterion_type, self.str_criterion_theme], 
+                                            ascending = [1, 1, 1])
+            points = rubric.iloc[:(comments_row - (nrows_separating_comments + 1))]
+            points = points.sort_values(by = [self.str_category, self.str_criterion_type, self.str_criterion_theme], 
+                                        ascending = [1, 1, 1])
+        
+        return {"rubric": rubric, 
+                "comments_row": comments_row, 
+                "comments": comments, 
+                "points": points, 
+                "criteria_colnames": list(points.columns[0:self.ncols_criteria].values), 
+                "merge_conflicts": merge_conflicts}
+    
+    def merge_student_columns(self, rubric, filename, sheetname, merge_conflicts, skiprows = 2):
+        """ 
+        Adds the students in a sheet of a secondary workbook to a rubric parsed from 
+        the main workbook. The rubric block (the first ncols_criteria columns) of the 
+        sheet must be identical to the one in the main workbook, as the rows are 
+        matched by position. Students that are in both workbooks are merged cell by 
+        cell, so that each grader can fill in their own students in a complete copy 
+        of the workbook. Cells filled in with different values in the two workbooks 
+        are added to merge_conflicts as (student, criterion, value, other value, 
+        filename) tuples, and the value in the main workbook is kept. 
+        """
+        if filename not in self.secondary_workbooks:
+            self.secondary_workbooks[filename] = pd.ExcelFile(filename)
+        xls = self.secondary_workbooks[filename]
+        if sheetname not in xls.sheet_names:
+            return rubric
+        other = xls.parse(sheetname, skiprows = skiprows)
+        
+        criteria_cols = list(rubric.columns[:self.ncols_criteria])
+        if list(other.columns[:self.ncols_criteria]) != criteria_cols or \
+                len(other) != len(rubric) or \
+                not rubric[criteria_cols].equals(other[criteria_cols]):
+            raise AssertionError(f"The rubric in '{sheetname}' of {filename} differs from the " + \
+                                 f"one in {self.filename}. Only the student columns may differ.")
+        
+        new_students = {}
+        for student in other.columns[self.ncols_criteria:]:
+            if student not in rubric.columns:
+                new_students[student] = other[student]
+                continue
+            
+            values, other_values = rubric[student], other[student]
+            conflicts = values.notna() & other_values.notna() & (values != other_values)
+            for i in np.nonzero(conflicts.values)[0]:
+                merge_conflicts.append((student, rubric[self.str_criterion_theme].iat[i], 
+                                        values.iat[i], other_values.iat[i], filename))
+            rubric[student] = values.where(values.notna(), other_values)
+        
+        if new_students:
+            rubric = pd.concat([rubric, pd.DataFrame(new_students)], axis = 1)
+        return rubric
+    
+    def get_activity_model(self, activity_number):
+        """ Returns the compiled model of an activity, compiling it on first use. """
+        if activity_number not in self.activity_models:
+            # Parse the activity first, so that parsing isn't timed as part of compiling
+            self.get_activity(activity_number)
+            with self.timer.span("compile model"):
+                self.activity_models[activity_number] = self.compile_activity_model(activity_number)
+        return self.activity_models[activity_number]
+    
+    def compile_activity_model(self, activity_number):
+        """ 
+        Collects everything needed to write reports for an activity from the sorted 
+        points and comments, so that reports can be written without further sorting 
+        or filtering of dataframes.
+        """
+        df_points = self.get_points(activity_number, include_evaluation_criteria = True)
+        df_comments = self.get_comments(activity_number, include_evaluation_criteria = True)
+        students = list(self.get_students(activity_number))
+        
+        # Criteria are listed category by category in the reports. Only named criteria 
+        # are included, and they are matched with the points and comments by position.
+        categories = self.get_categories(activity_number)
+        criteria = []
+        category_ranges = []
+        for category in categories:
+            criteria_this_category = self.get_criteria(category, activity_number)
+            category_ranges.append((category, len(criteria), len(criteria) + len(criteria_this_category)))
+            criteria += criteria_this_category
+        
+        levels = [self.achievement_level_low, self.achievement_level_mid, self.achievement_level_hi]
+        scores = self.get_points_matrix(activity_number)
+        level_labels, colored_level_labels = self.get_combined_achievement_level_labels()
+        
+        model = ActivityModel(
+            activity_number = activity_number, 
+            students = students, 
+            criteria = criteria, 
+            category_ranges = category_ranges, 
+            table_categories = df_comments[self.str_category].values, 
+            table_criteria = df_comments[self.str_criterion_theme].values, 
+            levels = levels, 
+            generic_comments = df_points[levels].values, 
+            student_points = [df_points[student].values for student in students], 
+            student_comments = [df_comments[student].values for student in students], 
+            level_codes = self.classify_achievement_levels(scores), 
+            color_codes = self.classify_colors(scores), 
+            level_labels = level_labels, 
+            colored_level_labels = colored_level_labels, 
+            combined_generic_comments = [])
+        
+        # The generic comments each criterion gets at every achievement level
+        combinations = self.get_achievement_level_combinations()[:-1]
+        for i in range(len(model.generic_comments)):
+            comments_this_criterion = list()
+            for level in combinations:
+                if isinstance(level, list):
+                    comment = [model.get_generic_comment(i, x) for x in level]
+                else:
+                    comment = model.get_generic_comment(i, level)
+                try:
+                    comments_this_criterion.append(self.combine_generic_comment(level, comment))
+                except TypeError:
+                    comments_this_criterion.append(None)
+            model.combined_generic_comments.append(tuple(comments_this_criterion))
+        return model
+    
+    def share_activity_model(self, activity_number, summary_table = True, colors = True, 
+                             include_scores = False, toc = False, directory = None):
+        """ 
+        Writes the points, achievement levels and comments of all students in an 
+        activity to a memory-mapped file, and returns a SharedActivityModel that can 
+        generate their reports without the Evaluator. The SharedActivityModel can be 
+        sent to worker processes, which map the file instead of receiving a copy of 
+        the data. The file is written to directory (the system's temporary folder by 
+        default), and is deleted when the returned model is closed.
+        """
+        model = self.get_activity_model(activity_number)
+        template = self.get_report_template(activity_number, summary_table = summary_table, 
+                                            colors = colors, include_scores = include_scores)
+        
+        # Points are stored as floats, but formatted as in the workbook. Cells that 
+        # are not numbers are only used for formatting.
+        points = np.full((len(model.students), len(model.student_points[0]) if model.students else 0), np.nan)
+        integer_points = np.zeros(points.shape, dtype = bool)
+        point_texts = {}
+        for j, column in enumerate(model.student_points):
+            for i, x in enumerate(column):
+                if isinstance(x, (int, np.integer)) and not isinstance(x, (bool, np.bool_)):
+                    points[j, i] = x
+                    integer_points[j, i] = True
+                elif isinstance(x, (float, np.floating)):
+                    points[j, i] = x
+                else:
+                    point_texts[(j, i)] = str(x)
+        
+        # The specific comments are stored as one utf-8 string, with the start and 
+        # length of each comment (-1 for cells without a comment)
+        comment_starts = np.zeros((len(model.students), len(model.student_comments[0]) if model.students else 0), 
+                                  dtype = np.int64)
+        comment_lengths = np.full(comment_starts.shape, -1, dtype = np.int64)
+        comments = []
+        n_bytes = 0
+        for j, column in enumerate(model.student_comments):
+            for i, comment in enumerate(column):
+                if type(comment) == str:
+                    encoded = comment.encode("utf-8")
+                    comment_starts[j, i] = n_bytes
+                    comment_lengths[j, i] = len(encoded)
+                    comments.append(encoded)
+                    n_bytes += len(encoded)
+        
+        arrays = {"points": points, 
+                  "integer_points": integer_points, 
+                  "level_codes": np.ascontiguousarray(model.level_codes.T), 
+                  "color_codes": np.ascontiguousarray(model.color_codes.T), 
+                  "comment_starts": comment_starts, 
+                  "comment_lengths": comment_lengths, 
+                  "comments": np.frombuffer(b"".join(comments), dtype = np.uint8)}
+        
+        return SharedActivityModel(
+            arrays, activity_number = activity_number, 
+            students = model.students, 
+            criteria = model.criteria, 
+            point_texts = point_texts, 
+            level_labels = model.level_labels, 
+            colored_level_labels = model.colored_level_labels, 
+            combined_generic_comments = model.combined_generic_comments, 
+            colors = self.colors, 
+            str_reason_for_lowerscore = self.str_reason_for_lowerscore, 
+            template = template, 
+            profile = self.get_render_profile(toc = toc), 
+            directory = directory)
+    
     def read_evaluation_rubrics(self, ):
         """ Reads an evaluation rubric from an .xlsx file """
         return self.xls_file.parse()
     
     def find_evaluation_rubric_sheetnames(self):
         """ Finds the names of the sheets that contain evaluation rubrics. """
-        sn = pd.Series(self.xls_file.sheet_names)
+        sn = pd.Series(self.sheet_names)
         sheet_idxs_containing_rubrics = sn.str.contains(self.str_activity) & sn.str.contains(self.str_rubric)
         idx_rubrics = [i for i, x in enumerate(sheet_idxs_containing_rubrics) if x]
         sheetnames_rubrics = sn[idx_rubrics]
@@ -74,7 +468,7 @@ class Evaluator():
     
     def find_evaluation_rubric_sheetname_idxs(self):
         """ Finds the indices of the sheetnames that contain evaluation rubrics. """
-        sn = pd.Series(self.xls_file.sheet_names)
+        sn = pd.Series(self.sheet_names)
         sheet_idxs_containing_rubrics = sn.str.contains(self.str_activity) & sn.str.contains(self.str_rubric)
         sheetname_idxs = [i for i, x in enumerate(sheet_idxs_containing_rubrics) if x]
         return sheetname_idxs
@@ -104,7 +498,10 @@ class Evaluator():
         # Find the row index of the row just before the comments section starts
         rubric_idx = self.activity_numbers.index(activity_number)
         
-        df = self.rubrics[rubric_idx]
+        return self.locate_comments_row(self.rubrics[rubric_idx], skiprows = skiprows)
+    
+    def locate_comments_row(self, df, skiprows = 2):
+        """ Finds the row at which the comments start in a parsed rubric sheet. """
         matches_str_category = df[self.str_category].values == self.str_commentsrow
         idx_comments = np.where(matches_str_category)[0][0] + skiprows
         return idx_comments
@@ -164,11 +561,22 @@ class Evaluator():
         elif score > 3:
             return "Aquamarine"
     
+    def classify_colors(self, scores):
+        """ 
+        Vectorised version of get_color_from_score. Returns an integer array of the same 
+        shape as scores, indexing self.colors, with -1 where no color applies (missing 
+        scores).
+        """
+        scores = np.asarray(scores, dtype = float)
+        conditions = [scores < 1, scores == 1, scores < 2, scores == 2, 
+                      scores < 3, scores == 3, scores > 3]
+        return np.select(conditions, range(len(conditions)), default = -1).astype(np.int8)
+    
     def get_comments(self, activity_number, include_evaluation_criteria = False):
         """ Get the comments for a specific activity, specified by its activity number. """
         self.validate_activity_number(activity_number)
+        # Already sorted by parse_activity
         df = self.comments[self.activity_numbers.index(activity_number)]
-        df = df.sort_values(by = [self.str_category, self.str_criterion_type, self.str_criterion_theme], ascending = [1, 1, 1])
 
         if include_evaluation_criteria:
             return df
@@ -195,8 +603,8 @@ class Evaluator():
             as a pandas dataframe. Optionally, the evaluation criteria can be included.
         """
         self.validate_activity_number(activity_number)
+        # Already sorted by parse_activity
         df = self.points[self.activity_numbers.index(activity_number)]
-        df = df.sort_values(by = [self.str_category, self.str_criterion_type, self.str_criterion_theme], ascending = [1, 1, 1])
 
         if include_evaluation_criteria:
             return df
@@ -241,85 +649,136 @@ class Evaluator():
             elif score == 3:
                 return self.achievement_level_hi
     
+    def get_achievement_level_combinations(self):
+        """ 
+        All possible return values of get_achievement_level, in the order used by 
+        classify_achievement_levels. The last entry (None) is the level of scores 
+        outside the rubric, so that it can be indexed by -1.
+        """
+        return [self.achievement_level_low, 
+                [self.achievement_level_low, self.achievement_level_mid], 
+                self.achievement_level_mid, 
+                [self.achievement_level_mid, self.achievement_level_hi], 
+                self.achievement_level_hi, 
+                None]
+    
+    def classify_achievement_levels(self, scores):
+        """ 
+        Vectorised version of get_achievement_level. Returns an integer array of the 
+        same shape as scores, indexing get_achievement_level_combinations(), with -1 
+        where no achievement level applies (missing scores or scores above 3).
+        """
+        scores = np.asarray(scores, dtype = float)
+        conditions = [scores <= 1, scores < 2, scores == 2, scores < 3, scores == 3]
+        return np.select(conditions, range(len(conditions)), default = -1).astype(np.int8)
+    
+    def get_points_matrix(self, activity_number):
+        """ 
+        The points of all students as a float array with one row per criterion and one 
+        column per student. Non-numeric points are treated as missing (NaN).
+        """
+        df = self.get_points(activity_number, include_evaluation_criteria = False)
+        return df.apply(pd.to_numeric, errors = "coerce").to_numpy(dtype = float)
+    
     def get_student_achievement_levels(self, student, activity_number, normalised = False):
         if not normalised:
-            score = self.get_student_points(student, activity_number, include_evaluation_criteria = True)
-            
-            achievement_levels = score[score.columns[-1]].apply(self.get_achievement_level)
+            model = self.get_activity_model(activity_number)
+            combinations = self.get_achievement_level_combinations()
             
-            return [x for x in achievement_levels.values]
+            return [combinations[code] for code in model.get_student_level_codes(student)]
     
-    def get_combined_achievement_levels(self, student, activity_number, 
-                                        normalised = False, colors = False):
-        
-        achievement_levels = self.get_student_achievement_levels(student, activity_number)
-        scores = self.get_student_points(student, activity_number).values
-        
-        combined_achievement_levels = list()
-        
-        for i, level in enumerate(achievement_levels):
+    def get_combined_achievement_level_labels(self):
+        """ 
+        Text describing each achievement level combination. Returns the labels and the 
+        labels colored with each of self.colors, indexed as [level][color].
+        """
+        labels = list()
+        for level in self.get_achievement_level_combinations()[:-1]:
             if isinstance(level, list):
                 s = self.str_combine_achievement_levels_start + level[0].split()[0].lower() + \
                     self.str_combine_achievement_levels_mid + level[1].lower()
 
             else:
                 s = self.str_combine_achievement_levels_single + level.lower()
-            
-            if colors:
-                s = "\\textcolor{"+ self.get_color_from_score(scores[i]) +"}{" + s + "}"
-            combined_achievement_levels.append(s)
-
-        return combined_achievement_levels
+            labels.append(s)
+        
+        colored_labels = [["\\textcolor{"+ color +"}{" + s + "}" for color in self.colors] 
+                          for s in labels]
+        return labels, colored_labels
+    
+    def get_combined_achievement_levels(self, student, activity_number, 
+                                        normalised = False, colors = False):
+        
+        model = self.get_activity_model(activity_number)
+        level_codes = model.get_student_level_codes(student)
+        color_codes = model.get_student_color_codes(student)
+        self.validate_level_codes(level_codes, student, activity_number)
+        
+        if colors:
+            return [model.colored_level_labels[level][color] 
+                    for level, color in zip(level_codes, color_codes)]
+        else:
+            return [model.level_labels[level] for level in level_codes]
+    
+    def validate_level_codes(self, level_codes, student, activity_number):
+        if (level_codes < 0).any():
+            raise AssertionError(f"Missing or out of range scores for {student} " + \
+                                 f"in activity {activity_number}.")
     
     
     def get_generic_comments(self, achievement_levels, activity_number):
         """ Given a list of achievement levels, generate generic comments. """
-        activity_idx = self.activity_numbers.index(activity_number)
-        df_scores = self.points[activity_idx]
+        model = self.get_activity_model(activity_number)
         
         comments = list()
         for i, level in enumerate(achievement_levels):
-            comment = df_scores[level].iloc[i]
-            
             # Depending on the score, there might be several comments applicable, so get 
             # all of them.
-            if isinstance(comment, pd.Series):
-                comments.append([x for x in comment.values])
+            if isinstance(level, list):
+                comments.append([model.get_generic_comment(i, x) for x in level])
             else:
-                comments.append(comment)
+                comments.append(model.get_generic_comment(i, level))
         return comments
     
     
     def get_combined_generic_comments(self, student, activity_number, colors = True):
-        scores = self.get_student_points(student, activity_number).values
+        model = self.get_activity_model(activity_number)
+        level_codes = model.get_student_level_codes(student)
+        self.validate_level_codes(level_codes, student, activity_number)
+        
+        combined_generic_comments = [model.combined_generic_comments[i][level] 
+                                     for i, level in enumerate(level_codes)]
+        if None not in combined_generic_comments:
+            return combined_generic_comments
+        
+        # Some generic comments could not be combined when the model was compiled (e.g. 
+        # because they are missing), so combine them again to get the same error.
         achievement_levels = self.get_student_achievement_levels(student, activity_number)
+        return self.combine_generic_comments(achievement_levels, activity_number)
+    
+    def combine_generic_comments(self, achievement_levels, activity_number):
+        """ Formats the generic comments for the given achievement level of each criterion. """
         comments = self.get_generic_comments(achievement_levels, activity_number)
         
-        combined_generic_comments = list()
-        for i, (level, comment, score) in enumerate(zip(achievement_levels, comments, scores)):
-            #print(i, level, comment, score, "\n")
+        return [self.combine_generic_comment(level, comment) 
+                for level, comment in zip(achievement_levels, comments)]
+    
+    def combine_generic_comment(self, level, comment):
+        """ Formats the generic comment(s) of a single criterion at the given achievement level. """
+        # If level is a list of achievement levels, combine the generic comments at both levels
+        if isinstance(level, list):
+            comb_comments = "".join([
+                "".join([self.str_intermediate_performance, "\n\n"]),
+                "".join(["> *" + comment[0] + "*\n\n"]),
+                "".join(["> *" + comment[1] + "*\n\n"])
+            ])
+            return comb_comments
+        else:
+            gen_comment = "" 
+            gen_comment += self.str_performance + "\n\n"
+            gen_comment += "> *" + comment + "*\n\n"
             
-            # If level is a list of achievement levels, combine the generic comments at both levels
-            if isinstance(level, list):
-
-                col_lo = self.get_color_from_score(math.floor(score))
-                col_hi = self.get_color_from_score(math.ceil(score))
-
-                comb_comments = "".join([
-                    "".join([self.str_intermediate_performance, "\n\n"]),
-                    "".join(["> *" + comment[0] + "*\n\n"]),
-                    "".join(["> *" + comment[1] + "*\n\n"])
-                ])
-                combined_generic_comments.append(comb_comments)
-            else:
-                gen_comment = "" 
-                gen_comment += self.str_performance + "\n\n"
-                gen_comment += "> *" + comment + "*\n\n"
-                
-                combined_generic_comments.append(gen_comment)
-                
-                
-        return combined_generic_comments
+            return gen_comment
     
     def get_criteria(self, category, activity_number):
         activity_idx = self.activity_numbers.index(activity_number)
@@ -334,10 +793,8 @@ class Evaluator():
         criteria = df[[self.str_category, self.str_criterion_theme]]
         return list(criteria[~criteria.isnull()].values)
            
-    def write_report_to_file(self, str_report, student, activity_number, 
-                             temp = False, timestamp = True, 
-                             remove_temp_files = True, toc = False):
-        
+    def get_activity_path(self, activity_number, temp = False):
+        """ The folder in which reports for an activity are placed. """
         path = ""
         if temp:
             path += "./" + self.str_tempdir + "/"
@@ -346,12 +803,64 @@ class Evaluator():
         
         path += self.str_course_code + "/" + \
                 self.str_course_semester + "/" + self.str_activity + "_" + \
-                str(activity_number) + "/" + student + "/"
+                str(activity_number) + "/"
+        return path
+    
+    def get_student_path(self, student, activity_number, temp = False):
+        """ The folder in which a student's reports for an activity are placed. """
+        return self.get_activity_path(activity_number, temp = temp) + student + "/"
+    
+    def make_dir(self, path):
+        """ 
+        Creates a folder, unless it has already been created by this evaluator during 
+        the current run (see plan_reports).
+        """
+        if path not in self.created_dirs:
+            os.makedirs(path, exist_ok=True)
+            self.created_dirs.add(path)
+    
+    def make_report_dirs(self, students, activity_number, temp = False):
+        """ Creates the folders for the reports of the given students in one pass. """
+        for student in students:
+            self.make_dir(self.get_student_path(student, activity_number, temp = temp))
+    
+    def get_export_formats(self, formats = None, remove_temp_files = True):
+        """ 
+        The formats ("pdf", "html" and/or "md") reports should be exported to, in a 
+        fixed order. Defaults to pdf only. For backwards compatibility, 
+        remove_temp_files = False also keeps the markdown and html versions.
+        """
+        formats = list(formats or ["pdf"])
+        if not remove_temp_files:
+            formats += ["md", "html"]
+        
+        unknown = [x for x in formats if x not in self.export_formats]
+        if unknown:
+            raise AssertionError("Unknown export format(s) " + str(unknown) + \
+                                 ". Supported formats are " + str(list(self.export_formats)))
+        return tuple(x for x in self.export_formats if x in formats)
+    
+    def get_activity_report_name(self, activity_number):
+        """ The common part of the file names of all reports for an activity. """
+        return self.str_report + "_" + self.str_course_code + "_" + \
+            self.str_course_semester + "_" + self.str_activity + "_" + str(activity_number)
+    
+    def prepare_report_export(self, student, activity_number, temp = False, 
+                              timestamp = True, toc = False):
+        """ 
+        Creates the output folder for a student's report and returns the file name 
+        (without extension) and the render profile that should be used to export it.
+        """
+        path = self.get_student_path(student, activity_number, temp = temp)
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        fn_student = path + \
-            self.str_report + "_" + self.str_course_code + "_" + \
-            self.str_course_semester + "_" + self.str_activity + "_" + str(activity_number) + "_" + \
+        self.make_dir(path)
+        fn_student = path + self.get_report_basename(student, activity_number, temp = temp, 
+                                                     timestamp = timestamp)
+        return fn_student, self.get_render_profile(toc = toc)
+    
+    def get_report_basename(self, student, activity_number, temp = False, timestamp = True):
+        """ The file name (without folder and extension) of a student's report. """
+        fn_student = self.get_activity_report_name(activity_number) + "_" + \
             student.replace(" ", "_").replace(",", "") #+ t
         
         if temp:
@@ -359,53 +868,65 @@ class Evaluator():
         
         if timestamp: 
             fn_student += strftime("_%Y%m%d_%H%M%S", gmtime())
-
-        fn_txt = fn_student + ".txt"
-        fn_md = fn_student + ".md"
-        fn_pdf = fn_student + ".pdf"
-        fn_html = fn_student + ".html"
-            
-        os.makedirs(os.path.dirname(fn_md), exist_ok=True)
-        with open(fn_md, "w+") as f:
-            f.write(str_report)
-            f.close()
-                    
-        # Write report as text first
-        os.makedirs(os.path.dirname(fn_txt), exist_ok=True)
-        with open(fn_txt, "w+") as f:
-            f.write(str_report)
-            f.close()
-
-        # Then read text file and create html
-        input_file = codecs.open(fn_txt, mode="r", encoding="utf-8")
-        text = input_file.read()
-        html = markdown.markdown(text)
-                
-        # Write html file
-        os.makedirs(os.path.dirname(fn_html), exist_ok=True)
-        output_file = codecs.open(fn_html, "w", encoding="latin-1",errors="xmlcharrefreplace")
-        output_file.write(html)
-
-        pargs = self.pandoc_args
+        return fn_student
+    
+    def get_render_profile(self, toc = False):
+        """ The render profile used to export reports. It is only created once per evaluator. """
+        if toc not in self.render_profiles:
+            self.render_profiles[toc] = RenderProfile(self.get_pandoc_args(toc = toc))
+        return self.render_profiles[toc]
+    
+    def precompile_render_profile(self, str_report, toc = False):
+        """ 
+        Precompiles the LaTeX preamble of the render profile into a format file, using 
+        str_report as an example of the reports that will be exported. Format files 
+        are kept in the temporary folder, so they are reused by later runs as long as 
+        the preamble doesn't change.
+        """
+        profile = self.get_render_profile(toc = toc)
+        if profile.format_file is None:
+            format_dir = os.path.abspath(os.path.join(self.str_tempdir, "formats"))
+            self.make_dir(format_dir)
+            try:
+                success = profile.precompile(str_report, format_dir)
+            except Exception as e:
+                print(e)
+                success = False
+            if not success:
+                print("Could not precompile the LaTeX preamble, the preamble will be loaded for every report.")
+        return profile
+    
+    def get_pandoc_args(self, toc = False):
+        """ The arguments passed to pandoc when converting a report to pdf. """
+        # Copy, so that self.pandoc_args doesn't grow with every export
+        pargs = list(self.pandoc_args)
             
         pargs.append('--highlight-style=pygments')
-        pargs.append('--include-in-header=config/header.tex')
-        pargs.append('--include-after-body=config/after-body.tex')
+        pargs.append('--include-in-header=' + self.fn_header)
+        pargs.append('--include-after-body=' + self.fn_after_body)
         pargs.append('--pdf-engine=xelatex')
         
         if toc: 
             pargs.append('--table-of-contents')
             
-        #print(pargs)
-        # Convert temporary markdown file to pdf using pandoc
-        output = pypandoc.convert_file(fn_md, 'pdf', format="markdown",
-                    outputfile = fn_pdf, 
-                    extra_args = pargs)
-        
-        if remove_temp_files:
-            os.remove(fn_txt)
-            os.remove(fn_md)
-            os.remove(fn_html)
+        return pargs
+           
+    def write_report_to_file(self, report, student, activity_number, 
+                             temp = False, timestamp = True, 
+                             remove_temp_files = True, toc = False, formats = None):
+        """ 
+        Exports a report (an EvaluationReport or a markdown string) to the given formats 
+        (see get_export_formats). Returns the file name of the first of them, i.e. the 
+        pdf if a pdf was exported.
+        """
+        formats = self.get_export_formats(formats, remove_temp_files)
+        fn_student, profile = self.prepare_report_export(student, activity_number, 
+                                                         temp = temp, 
+                                                         timestamp = timestamp, 
+                                                         toc = toc)
+        export_report(report, fn_student, profile, formats = formats, 
+                      timer = self.timer, student = student)
+        return fn_student + "." + formats[0]
     
     def generate_report(self, student, activity_number, 
                         summary_table = True,
@@ -415,167 +936,1964 @@ class Evaluator():
                         timestamp = True, 
                         remove_temp_files = True, 
                         toc = False,
-                        include_scores = False):
-        
-        """ Write report as pdf. Requires latex packages textcolorx, environ and tcolorbox, trimspaces. """
-        # String that will hold the report.            
-        str_report = ''.join(["# ", "Vurdering i ", self.str_course_code, ", ", self.str_course_semester, \
-                     " aktivitet ", str(activity_number), " (", student, ")\n\n"])
-        
-        if summary_table:
-            str_report += "## " + self.str_summary + "\n\n"
-            str_report += self.make_achievement_level_table(student, activity_number, 
-                                                            include_scores = include_scores, 
-                                                            colors = colors) + "\n\n"
-            str_report += "\\pagebreak"
-        #str_report += "## " + self.str_feedback + "\n\n"
+                        include_scores = False, 
+                        formats = None):
         
+        """ 
+        Write report as pdf. Requires latex packages textcolorx, environ and tcolorbox, trimspaces. 
+        Other formats can be selected with formats (see get_export_formats).
+        Returns the file name of the pdf if exported (None if the export failed), 
+        otherwise the report as an EvaluationReport, which renders the markdown, html 
+        and pdf on demand.
+        """
+        template = self.get_report_template(activity_number, summary_table = summary_table, 
+                                            colors = colors, include_scores = include_scores)
+        model = self.get_activity_model(activity_number)
+        with self.timer.span("markdown", student):
+            report = EvaluationReport(student, activity_number, model.criteria, 
+                                      model.get_student_points(student), 
+                                      model.get_student_level_codes(student), 
+                                      self.get_report_values(student, activity_number), 
+                                      template, self.get_render_profile(toc = toc))
         
-        if include_scores:
-            scores = self.get_student_points(student, activity_number).values
+        if export:
+            try:
+                
+                return self.write_report_to_file(report, student, activity_number, 
+                    temp = temp, 
+                    timestamp = timestamp, 
+                    remove_temp_files = remove_temp_files, 
+                    toc = toc, 
+                    formats = formats)
+            except Exception as e: 
+                print(f"Export failed for {student}")
+                print(e)
+            
+        else:
+            return report
+    
+    def get_report_template(self, activity_number, summary_table = True, colors = True, 
+                            include_scores = False):
+        """ Returns the report template of an activity, compiling it on first use. """
+        key = (activity_number, summary_table, colors, include_scores)
+        if key not in self.report_templates:
+            self.get_activity_model(activity_number)
+            with self.timer.span("compile template"):
+                self.report_templates[key] = self.compile_report_template(
+                    activity_number, summary_table = summary_table, colors = colors, 
+                    include_scores = include_scores)
+        return self.report_templates[key]
+    
+    def compile_report_template(self, activity_number, summary_table = True, colors = True, 
+                                include_scores = False):
+        """ 
+        Compiles the parts of the reports of an activity that are the same for all 
+        students (headings, category sections, criterion names and table rows) into 
+        a ReportTemplate. The slots of the template are filled in with the values 
+        from get_report_values.
+        """
+        model = self.get_activity_model(activity_number)
+        template = ReportTemplate()
         
-        # We also need the points to color properly
-        student_points = self.get_student_points(student, activity_number).values
+        template.add_text(''.join(["# ", "Vurdering i ", self.str_course_code, ", ", self.str_course_semester, \
+                                   " aktivitet ", str(activity_number), " ("]))
+        template.add_slot("student")
+        template.add_text(")\n\n")
         
-        for score in student_points:
-            if not isinstance(2, numbers.Number):
-                any_bad_vals = True
-                print(f"REPORT GENERATION FAILED: Missing or incomplete scores for {student}.")
-                    
-        combined_achievement_levels = self.get_combined_achievement_levels(student, activity_number)
-        combined_generic_comments = self.get_combined_generic_comments(student, activity_number)
-        specific_comments = self.get_student_comments(student, activity_number, include_evaluation_criteria = False).values
+        if summary_table:
+            template.add_text("## " + self.str_summary + "\n\n")
+            self.compile_achievement_level_table(template, model, include_scores = include_scores)
+            template.add_text("\n\n\\pagebreak")
         
         # Go over the criteria in each category
-        criteria_counter = 0
-        categories = self.get_categories(activity_number)
-        categories_counts = self.get_category_counts(activity_number)
-            
         total_criteria_counter = 0
-        for i, (category, count) in enumerate(zip(categories, categories_counts)):
+        for category, start, stop in model.category_ranges:
             # Remember space after # if interpreting as heading
             # Also need double line shift to separate heading from
             # content under that heading.
-            criteria_this_category = self.get_criteria(category, activity_number) 
-            
-            #print("Category: %s" % (category))
-            #comments_df = self.get_student_comments(student, activity_number, include_evaluation_criteria = True)
-            #scores_df = self.get_student_points(student, activity_number, include_evaluation_criteria = True)
-            #print(scores_df)
-            #for cat in criteria_this_category:
-                #comment = scores_df[level].iloc[i]
-                #print(scores_df[level].iloc[i])
-                #row = comments_df[comments_df[self.str_criterion_theme].str.contains(cat)]
-                #print(row)
-                #print("\t%s" % cat)
+            template.add_text('\n# ' + self.str_category + ": " + category + "\n")
             
-            str_report += '\n# ' + self.str_category + ": " + category + "\n" 
-            
-            for j, criterion in enumerate(criteria_this_category):
-                gen_score = combined_achievement_levels[total_criteria_counter]
-                gen_comment = combined_generic_comments[total_criteria_counter]
-                specific_comment = specific_comments[total_criteria_counter]
-                score = student_points[total_criteria_counter]
+            for criterion in model.criteria[start:stop]:
+                i = total_criteria_counter
                 
                 # start coloring in header
                 if colors:
-                    col = self.get_color_from_score(student_points[total_criteria_counter])
-                    str_report += '\n## ' + "\\textcolor{" + col + "}{" + criterion
+                    template.add_text('\n## ' + "\\textcolor{")
+                    template.add_slot("color", i)
+                    template.add_text("}{" + criterion + " [")
+                    template.add_slot("level", i)
                     
                     # add achievement level in brackets
                     if include_scores:
-                        str_report += " [" + gen_score + ", " + str(score) + " " + \
-                            self.str_points 
-                    else:
-                        str_report += " [" + gen_score
-                    str_report += "]}" # stop coloring
+                        template.add_text(", ")
+                        template.add_slot("score", i)
+                        template.add_text(" " + self.str_points)
+                    template.add_text("]}") # stop coloring
                 else:
                     # add achievement level in brackets
-                    str_report += '\n## ' + criterion  + " [" + gen_score + "]"
-               
-                str_report += "\n\n" + gen_comment
+                    template.add_text('\n## ' + criterion + " [")
+                    template.add_slot("level", i)
+                    template.add_text("]")
                 
-                if type(specific_comment) == str:
-                    str_report += "**" + self.str_reason_for_lowerscore + "**: "
-                    str_report += specific_comment
-                    
-                str_report += "\n"
+                template.add_text("\n\n")
+                template.add_slot("generic_comment", i)
+                template.add_slot("specific_comment", i)
+                template.add_text("\n")
                 
                 # Update the number of criteria we've processed
                 total_criteria_counter += 1
-
-            # Another line break for good measure after criteria have been added
-            str_report += "\n"
             
-        if export:
-            try:
-                
-                self.write_report_to_file(str_report, student, activity_number, 
-                    temp = temp, 
-                    timestamp = timestamp, 
-                    remove_temp_files = remove_temp_files, 
-                    toc = toc)
-            except Exception as e: 
-                print(f"Export failed for {student}")
-                print(e)
+            # Another line break for good measure after criteria have been added
+            template.add_text("\n")
+        
+        return template.compile()
+    
+    def compile_achievement_level_table(self, template, model, include_scores = False):
+        """ Adds the summary table of the achievement level of each criterion to a report template. """
+        # The table has a row for every criterion, also those without a name
+        n_rows = min(len(model.table_categories), len(model.table_criteria), len(model.level_codes))
+        rows = zip(model.table_categories[:n_rows], model.table_criteria[:n_rows])
+        
+        if include_scores:
+            template.add_text("|" + self.str_category + " | " + self.str_criterion_theme + " | " + self.str_achievement + " | " + self.str_table_score + " | \n")
+            template.add_text("|" + "---" + " | " + "---" + " | " + "---" + " | " + "---" + " |\n")
             
+            for i, (cat, crit) in enumerate(rows):
+                template.add_text("|" + cat + " | " + crit + " | ")
+                template.add_slot("colored_level", i)
+                template.add_text(" | " + "\\textcolor{")
+                template.add_slot("color", i)
+                template.add_text("}{")
+                template.add_slot("score", i)
+                template.add_text("}" + "|\n")
         else:
-            return str_report
+            template.add_text("|" + self.str_category + " | " + self.str_criterion_theme + " | " + self.str_achievement + " |\n")
+            template.add_text("|" + "---" + " | " + "---" + " | " + "---" + " |\n")
+            
+            for i, (cat, crit) in enumerate(rows):
+                template.add_text("|" + cat + " | " + crit + " | ")
+                template.add_slot("colored_level", i)
+                template.add_text(" |\n")
+    
+    def get_report_values(self, student, activity_number):
+        """ 
+        The values that are filled into the slots of a report template for a student, 
+        indexed by slot name and criterion.
+        """
+        model = self.get_activity_model(activity_number)
+        level_codes = model.get_student_level_codes(student)
+        color_codes = model.get_student_color_codes(student)
+        self.validate_level_codes(level_codes, student, activity_number)
+        
+        specific_comments = ["**" + self.str_reason_for_lowerscore + "**: " + comment 
+                             if type(comment) == str else "" 
+                             for comment in model.get_student_comments(student)]
+        return {
+            "student": [student], 
+            "level": [model.level_labels[level] for level in level_codes], 
+            "colored_level": [model.colored_level_labels[level][color] 
+                              for level, color in zip(level_codes, color_codes)], 
+            "color": [self.colors[color] for color in color_codes], 
+            "score": [str(score) for score in model.get_student_points(student)], 
+            "generic_comment": self.get_combined_generic_comments(student, activity_number), 
+            "specific_comment": specific_comments}
      
     def make_achievement_level_table(self, student, activity_number, include_scores = False, colors = True):
-        df = self.get_complete_criteria(activity_number=activity_number)[['Kategori', 'Vurderingskriterium']]
-        categories = df[self.str_category].values
-        criteria = df[self.str_criterion_theme].values
-        achievement_levels = self.get_combined_achievement_levels(student, activity_number, colors = True)
-        scores = self.get_student_points(student, activity_number)
+        template = ReportTemplate()
+        self.compile_achievement_level_table(template, self.get_activity_model(activity_number), 
+                                             include_scores = include_scores)
+        return template.compile().render(self.get_report_values(student, activity_number))
+    
+    def profile_report(self, student, activity_number, fn_stats = None, n_lines = 30, **kwargs):
+        """ 
+        Generates the report of a single student (see generate_report) under cProfile, 
+        and prints the functions with the highest cumulative time. This includes 
+        parsing and compiling the activity, unless that has already been done. The 
+        full statistics are saved to fn_stats if given, e.g. for snakeviz. Returns 
+        what generate_report returns.
+        """
+        import cProfile
+        import pstats
         
+        profiler = cProfile.Profile()
+        result = profiler.runcall(self.generate_report, student, activity_number, **kwargs)
         
-        if include_scores:
-            t = "|" + self.str_category + " | " + self.str_criterion_theme + " | " + self.str_achievement + " | " + self.str_table_score + " | \n"
-            t += "|" + "---" + " | " + "---" + " | " + "---" + " | " + "---" + " |\n"
-
-            for i, (cat, crit, lvl, score) in enumerate(zip(categories, criteria, achievement_levels, scores)):
-                score_col = self.get_color_from_score(score)
-                str_score = "\\textcolor{" + score_col + "}{" + str(score) + "}"
-                t += "|" + cat + " | " + crit + " | " + lvl + " | " + str_score + "|\n"
-
-            return t
-        else:
-            t = "|" + self.str_category + " | " + self.str_criterion_theme + " | " + self.str_achievement + " |\n"
-            t += "|" + "---" + " | " + "---" + " | " + "---" + " |\n"
-
-            for i, (cat, crit, lvl) in enumerate(zip(categories, criteria, achievement_levels)):
-                t += "|" + cat + " | " + crit + " | " + lvl + " |\n"
-
-            return t
+        stats = pstats.Stats(profiler)
+        if fn_stats is not None:
+            stats.dump_stats(fn_stats)
+        stats.sort_stats("cumulative").print_stats(n_lines)
+        return result
     
-    def generate_reports(self, activity_number, **kwargs):
-        """ Generate reports for all students for a given activity. """
-        students = self.get_students(activity_number)
+    def generate_reports(self, activity_number, workers = 1, batch = False, 
+                         force = False, precompile = False, students = None, **kwargs):
+        """ 
+        Generate reports for all students for a given activity. If workers > 1, the 
+        markdown for each student is generated in this process, and the pdf 
+        conversions are distributed over a pool of that many worker processes. 
+        If batch = True, all reports are instead compiled in a single LaTeX run and 
+        the resulting pdf is split into one file per student (requires pypdf).
         
-        failed = []
-        for student in students:
-            scores = self.get_student_points(student, activity_number)
+        Students whose data and report settings are unchanged since their report was 
+        last generated (according to the build manifest of the activity) are skipped, 
+        unless force = True. If precompile = True, the LaTeX preamble is precompiled 
+        once (see RenderProfile) instead of being loaded for every report. 
+        If students is given, only the reports of those students are generated. 
+        Returns the students for which no report could be generated.
+        """
+        if batch:
+            # Check the settings before any reports are generated
+            self.get_batch_export_formats(kwargs.get("formats"), kwargs.get("remove_temp_files", True), 
+                                          kwargs.get("toc", False))
+        timer_mark = self.timer.mark()
+        manifest, student_hashes, pending, failed = self.plan_reports(activity_number, force = force, 
+                                                                      students = students, **kwargs)
+        export_kwargs = dict(temp = kwargs.get("temp", False), 
+                             timestamp = kwargs.get("timestamp", True), 
+                             remove_temp_files = kwargs.get("remove_temp_files", True), 
+                             toc = kwargs.get("toc", False), 
+                             formats = kwargs.get("formats"))
+        exports = []
+        exported = {}
+        for student in pending:
+            report = self.generate_report(student, activity_number, **dict(kwargs, export = False))
+            if precompile:
+                # Use the first report that is exported to precompile the preamble
+                self.precompile_render_profile(report.markdown, toc = kwargs.get("toc", False))
+                precompile = False
             
-            # Test inputs for NaNs or other non-numeric values
-            any_bad_vals = False
-            if any([isinstance(score, numbers.Number) == False for score in scores]) or any([np.isnan(score) for score in scores]):
-                    any_bad_vals = True
-                    print(f"REPORT GENERATION FAILED: Missing or incomplete scores for {student}.")
+            if workers > 1 or batch:
+                exports.append((student, report))
+            else:
+                try:
+                    exported[student] = self.write_report_to_file(report, student, activity_number, 
+                                                                  **export_kwargs)
+                    print(f"SUCCESS: generated report for {student}")
+                except Exception as e:
+                    print(f"Export failed for {student}")
+                    print(e)
                     failed.append(student)
-                    
+        
+        if exports:
+            if batch:
+                exported.update(self.export_reports_batch(exports, activity_number, **export_kwargs))
+            else:
+                exported.update(self.export_reports(exports, activity_number, workers = workers, 
+                                                    **export_kwargs))
+            failed += [student for student, report in exports if student not in exported]
+        
+        return self.finish_reports(activity_number, manifest, student_hashes, exported, failed, 
+                                   temp = kwargs.get("temp", False), timer_mark = timer_mark)
+    
+    async def generate_reports_async(self, activity_number, concurrency = 4, timeout = 600, 
+                                     retries = 1, progress = None, force = False, 
+                                     precompile = False, students = None, **kwargs):
+        """ 
+        Generate reports for all students for a given activity, running pandoc (and 
+        the LaTeX engine) as subprocesses. At most concurrency conversions run at 
+        the same time, and the conversions run while the markdown for the next 
+        students is generated. A conversion that takes longer than timeout seconds 
+        is killed and retried up to retries times, so that a single report that 
+        makes LaTeX hang doesn't stall the other reports.
+        
+        progress is an optional function that is called as 
+        progress(student, status, n_done, n_total) whenever the conversion of a 
+        report starts ("started"), times out and is retried ("retrying"), or 
+        finishes ("success" or "failed"). 
+        
+        Otherwise works as generate_reports, and returns the students for which no 
+        report could be generated. See generate_reports_concurrently for a version 
+        that can be called outside of a coroutine.
+        """
+        import asyncio
+        
+        timer_mark = self.timer.mark()
+        manifest, student_hashes, pending, failed = self.plan_reports(activity_number, force = force, 
+                                                                      students = students, **kwargs)
+        formats = self.get_export_formats(kwargs.get("formats"), kwargs.get("remove_temp_files", True))
+        semaphore = asyncio.Semaphore(concurrency)
+        counts = {"done": 0, "total": len(pending)}
+        
+        def report_progress(student, status):
+            if status in ("success", "failed"):
+                counts["done"] += 1
+            if progress is not None:
+                progress(student, status, counts["done"], counts["total"])
+        
+        tasks = []
+        for student in pending:
+            report = self.generate_report(student, activity_number, **dict(kwargs, export = False))
+            if precompile:
+                self.precompile_render_profile(report.markdown, toc = kwargs.get("toc", False))
+                precompile = False
+            
+            fn_student, profile = self.prepare_report_export(student, activity_number, 
+                                                             temp = kwargs.get("temp", False), 
+                                                             timestamp = kwargs.get("timestamp", True), 
+                                                             toc = kwargs.get("toc", False))
+            tasks.append(asyncio.ensure_future(
+                self.export_report_async(student, report, fn_student, profile, formats, 
+                                         semaphore, timeout, retries, report_progress)))
+            # Let the conversions that have been scheduled start before the next report is generated
+            await asyncio.sleep(0)
+        
+        exported = {}
+        for student, fn_report in zip(pending, await asyncio.gather(*tasks)):
+            if fn_report is None:
+                failed.append(student)
             else:
-                self.generate_report(student, activity_number, **kwargs)
+                exported[student] = fn_report
+        
+        return self.finish_reports(activity_number, manifest, student_hashes, exported, failed, 
+                                   temp = kwargs.get("temp", False), timer_mark = timer_mark)
+    
+    def generate_reports_concurrently(self, activity_number, concurrency = 4, timeout = 600, 
+                                      retries = 1, progress = None, **kwargs):
+        """ Runs generate_reports_async to completion. Returns the students for which no report could be generated. """
+        import asyncio
+        
+        return asyncio.run(self.generate_reports_async(activity_number, concurrency = concurrency, 
+                                                       timeout = timeout, retries = retries, 
+                                                       progress = progress, **kwargs))
+    
+    async def export_report_async(self, student, report, fn_student, profile, formats, 
+                                  semaphore, timeout, retries, progress):
+        """ 
+        Exports a single report for generate_reports_async, retrying the conversion if it 
+        times out. Returns the file name of the first format, or None if the export failed.
+        """
+        import asyncio
+        
+        async with semaphore:
+            progress(student, "started")
+            for attempt in range(retries + 1):
+                try:
+                    await asyncio.wait_for(export_report_async(report, fn_student, profile, 
+                                                               formats = formats, 
+                                                               timer = self.timer, 
+                                                               student = student), timeout)
+                except asyncio.TimeoutError:
+                    print(f"Export of the report for {student} timed out after {timeout} seconds")
+                    if attempt < retries:
+                        progress(student, "retrying")
+                        continue
+                except Exception as e:
+                    print(f"Export failed for {student}")
+                    print(e)
+                else:
+                    print(f"SUCCESS: generated report for {student}")
+                    progress(student, "success")
+                    return fn_student + "." + formats[0]
+                break
+        progress(student, "failed")
+        return None
+    
+    def generate_reports_zip(self, activity_number, fn_zip = None, workers = 1, 
+                             max_pending = None, students = None, **kwargs):
+        """ 
+        Generates the reports of all students for an activity directly into a zip 
+        archive, e.g. for bulk upload of feedback to a learning management system. 
+        Each report is exported by a pool of worker processes to a temporary file, 
+        which is streamed into the archive and deleted as soon as it is finished, so 
+        the folders for each student are not created. The archive also contains a 
+        manifest.csv with the student, file name and SHA-256 of each report. 
+        
+        At most max_pending reports (2 * workers by default) are generated ahead of 
+        the workers, so that memory use doesn't grow with the number of students. 
+        fn_zip defaults to a timestamped file in the folder of the activity. If 
+        students is given, only the reports of those students are generated. The 
+        reports are always generated, even if they are up to date, so force can't be 
+        given. Other arguments are passed to generate_report. Returns the students 
+        for which no report could be generated.
+        """
+        if "force" in kwargs:
+            raise TypeError("generate_reports_zip always generates all reports, so force can't be given.")
+        formats = self.get_export_formats(kwargs.get("formats"), kwargs.get("remove_temp_files", True))
+        timestamp = kwargs.get("timestamp", True)
+        manifest, student_hashes, pending, failed = self.plan_reports(activity_number, force = True, 
+                                                                      students = students, 
+                                                                      make_dirs = False, **kwargs)
+        if fn_zip is None:
+            path = self.get_activity_path(activity_number, temp = kwargs.get("temp", False))
+            self.make_dir(path)
+            fn_zip = path + self.get_activity_report_name(activity_number)
+            if timestamp:
+                fn_zip += strftime("_%Y%m%d_%H%M%S", gmtime())
+            fn_zip += ".zip"
+        max_pending = max_pending or 2 * workers
+        
+        rows = {}
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                zipfile.ZipFile(fn_zip, "w", compression = zipfile.ZIP_DEFLATED) as archive, \
+                ProcessPoolExecutor(max_workers = workers) as pool:
+            
+            def add_to_archive(future):
+                student, fn_tmp, basename = futures.pop(future)
+                try:
+                    self.timer.merge(future.result())
+                except Exception as e:
+                    print(f"Export failed for {student}")
+                    print(e)
+                    failed.append(student)
+                    return
+                rows[student] = [(basename + "." + x, 
+                                  stream_to_archive(archive, fn_tmp + "." + x, basename + "." + x)) 
+                                 for x in formats]
                 print(f"SUCCESS: generated report for {student}")
+            
+            futures = {}
+            for i, student in enumerate(pending):
+                while len(futures) >= max_pending:
+                    done, not_done = wait(futures, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        add_to_archive(future)
+                
+                report = self.generate_report(student, activity_number, **dict(kwargs, export = False))
+                fn_tmp = os.path.join(tmpdir, str(i))
+                basename = self.get_report_basename(student, activity_number, 
+                                                    temp = kwargs.get("temp", False), 
+                                                    timestamp = timestamp)
+                future = pool.submit(export_report_in_worker, report, fn_tmp, 
+                                     self.get_render_profile(toc = kwargs.get("toc", False)), 
+                                     formats, self.timer.enabled, student)
+                futures[future] = (student, fn_tmp, basename)
+            
+            while futures:
+                done, not_done = wait(futures, return_when = FIRST_COMPLETED)
+                for future in done:
+                    add_to_archive(future)
+            
+            str_manifest = io.StringIO()
+            writer = csv.writer(str_manifest, lineterminator = "\n")
+            writer.writerow(["student", "file", "sha256"])
+            writer.writerows([(student, fn, sha256) for student in pending 
+                              for fn, sha256 in rows.get(student, [])])
+            archive.writestr("manifest.csv", str_manifest.getvalue())
         
+        failed = [student for student in self.get_students(activity_number) if student in failed]
+        print("Reports were written to " + fn_zip)
         print("Reports could not be generated for the following students:")
         print(failed)
-
-
-class EvaluationReport():
-    def __init__(self, data, data_path, str_report, student, activity_number):
-        self.data = data
-        self.data_path = data_path
-        self.str_report = str_report
-        self.student = student 
-        self.activity_number = activity_number
\ No newline at end of file
+        return failed
+    
+    def plan_reports(self, activity_number, force = False, students = None, make_dirs = True, 
+                     **kwargs):
+        """ 
+        Validates the scores of an activity and finds the students whose report needs 
+        to be generated, i.e. those with valid scores whose report is not up to date 
+        (or all of them if force = True), and creates their output folders. Only the 
+        given students are considered, if students is not None.
+        
+        Returns the build manifest, the hashes of the students' data, the students 
+        whose report should be generated, and the students whose scores are invalid.
+        """
+        if students is None:
+            students = self.get_students(activity_number)
+        else:
+            students = [student for student in self.get_students(activity_number) 
+                        if student in students]
+        # Folders may have been moved or deleted since the last run, e.g. in watch mode
+        self.created_dirs.clear()
+        manifest = self.read_build_manifest(activity_number, temp = kwargs.get("temp", False))
+        str_rubric_hash = self.get_rubric_hash(activity_number, **kwargs)
+        
+        # Check all scores before any reports are rendered
+        validation = self.validate_scores(activity_number)
+        if not validation.is_clean():
+            print(validation)
+        if make_dirs:
+            self.make_report_dirs([student for student in students if validation.is_clean(student)], 
+                                  activity_number, temp = kwargs.get("temp", False))
+        
+        failed = []
+        pending = []
+        student_hashes = {}
+        for student in students:
+            student_hashes[student] = self.get_student_hash(student, activity_number, 
+                                                            str_rubric_hash)
+            
+            if validation.ordering_mismatches:
+                print(f"REPORT GENERATION FAILED: The rows of the points and comments don't match for {student}.")
+                failed.append(student)
+            
+            elif not validation.is_clean(student):
+                print(f"REPORT GENERATION FAILED: Missing, incomplete or out of range scores for {student}.")
+                failed.append(student)
+                
+            elif not force and self.is_report_up_to_date(manifest, student, student_hashes[student]):
+                print(f"UP TO DATE: report for {student} is unchanged")
+            
+            else:
+                pending.append(student)
+        return manifest, student_hashes, pending, failed
+    
+    def finish_reports(self, activity_number, manifest, student_hashes, exported, failed, temp = False, 
+                       timer_mark = None):
+        """ 
+        Records the reports that were exported in the build manifest and reports the 
+        students that failed, in the order of the workbook. With timing, the time 
+        spent since timer_mark (see Timer.mark) is printed. Returns the failed students.
+        """
+        for student, fn_report in exported.items():
+            manifest[student] = {"hash": student_hashes[student], "report": fn_report}
+        self.write_build_manifest(manifest, activity_number, temp = temp)
+        
+        failed = [student for student in self.get_students(activity_number) if student in failed]
+        if self.timer.enabled:
+            print(self.timer.summary(since = timer_mark))
+        print("Reports could not be generated for the following students:")
+        print(failed)
+        return failed
+    
+    def watch(self, activity_numbers = None, interval = 1, debounce = 2, **kwargs):
+        """ 
+        Generates the reports for the given activities (all activities by default), 
+        and then keeps watching the workbook. Whenever it is saved, the sheets that 
+        changed are parsed again, and only the reports of the students whose points 
+        or comments changed are generated again (see reload_workbook). A burst of 
+        saves triggers a single update, once the workbook has been unchanged for 
+        debounce seconds. The workbook is checked every interval seconds, until 
+        interrupted with Ctrl-C. Other arguments are passed to generate_reports. With 
+        timing, the timer only keeps the records of the latest update, so that it 
+        doesn't grow while watching.
+        """
+        for activity_number in (activity_numbers or self.activity_numbers):
+            self.generate_reports(activity_number, **kwargs)
+        
+        checksums = self.get_sheet_checksums()
+        state = self.get_file_state()
+        print(f"Watching {self.filename} for changes. Press Ctrl-C to stop.")
+        try:
+            while True:
+                sleep(interval)
+                if self.get_file_state() == state:
+                    continue
+                
+                # Wait until the workbook has stopped changing
+                state = self.get_file_state()
+                while True:
+                    sleep(debounce)
+                    new_state = self.get_file_state()
+                    if new_state == state:
+                        break
+                    state = new_state
+                
+                self.timer.reset()
+                try:
+                    changed, checksums = self.reload_workbook(checksums)
+                except Exception as e:
+                    # E.g. if the workbook is saved again while it is read
+                    print(f"Could not read {self.filename}, waiting for the next save.")
+                    print(e)
+                    continue
+                
+                for activity_number, students in changed.items():
+                    if activity_numbers is not None and activity_number not in activity_numbers:
+                        continue
+                    if students:
+                        print(f"CHANGED: {len(students)} student(s) in activity {activity_number}")
+                        self.generate_reports(activity_number, students = students, **kwargs)
+        except KeyboardInterrupt:
+            print("Stopped watching " + self.filename)
+    
+    def get_file_state(self):
+        """ Size and modification time of the workbook(s), with None for missing files. """
+        state = []
+        for fn in [self.filename] + self.secondary_filenames:
+            try:
+                stat = os.stat(fn)
+                state.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                state.append(None)
+        return state
+    
+    def get_sheet_checksums(self):
+        """ 
+        The CRC-32 of the XML of each sheet of the workbook, by sheet name. An xlsx file 
+        is a zip archive, and the checksums are read from its directory, so nothing is 
+        decompressed. Text cells refer to a table of strings shared by all sheets, 
+        whose checksum is stored under the key None. Returns None if the workbook 
+        isn't a zip archive (e.g. an xls file).
+        """
+        ns_main = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+        ns_rels = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+        try:
+            with zipfile.ZipFile(self.filename) as z:
+                crcs = {info.filename: info.CRC for info in z.infolist()}
+                workbook = ElementTree.fromstring(z.read("xl/workbook.xml"))
+                rels = ElementTree.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+            return None
+        
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+        checksums = {None: crcs.get("xl/sharedStrings.xml")}
+        for sheet in workbook.iter(ns_main + "sheet"):
+            target = targets.get(sheet.get(ns_rels + "id"), "")
+            path = target[1:] if target.startswith("/") else "xl/" + target
+            checksums[sheet.get("name")] = crcs.get(path)
+        return checksums
+    
+    def reload_workbook(self, checksums = None):
+        """ 
+        Reads the workbook again after it has been modified. Only the activities whose 
+        sheet changed according to checksums (from get_sheet_checksums) are parsed 
+        again; with checksums = None, all activities that have been parsed are. 
+        
+        Returns a dictionary with the students whose points or comments changed in 
+        each activity (compared with the data that was in memory), and the new 
+        checksums.
+        """
+        new_checksums = self.get_sheet_checksums()
+        if checksums is None or new_checksums is None or checksums[None] != new_checksums[None] or \
+                self.secondary_filenames:
+            # Changes in secondary workbooks aren't tracked by the checksums
+            changed_sheets = None
+        else:
+            changed_sheets = set(name for name, crc in new_checksums.items() 
+                                 if checksums.get(name) != crc)
+        
+        if self.workbook is not None:
+            self.workbook.close()
+        for xls in self.secondary_workbooks.values():
+            xls.close()
+        self.secondary_workbooks = {}
+        self.workbook = None
+        self.workbook_key = None
+        old_activity_numbers = self.activity_numbers
+        self.sheet_names = self.find_sheet_names()
+        self.rubric_sheetnames = self.find_evaluation_rubric_sheetnames()
+        self.rubric_sheetidxs = self.find_evaluation_rubric_sheetname_idxs()
+        self.activity_numbers = self.find_activity_numbers()
+        
+        changed = {}
+        for activity_number, sheetname in zip(self.activity_numbers, self.rubric_sheetnames):
+            if activity_number not in old_activity_numbers:
+                changed[activity_number] = list(self.get_students(activity_number))
+            elif changed_sheets is None or sheetname in changed_sheets:
+                changed[activity_number] = self.reload_activity(activity_number)
+        
+        for activity_number in old_activity_numbers:
+            if activity_number not in self.activity_numbers:
+                self.forget_activity(activity_number)
+        return changed, new_checksums
+    
+    def reload_activity(self, activity_number):
+        """ 
+        Parses an activity again, and returns the students whose points or comments 
+        differ from the data in memory (all students if the rubric itself changed). 
+        Returns an empty list if the activity hadn't been parsed before.
+        """
+        old = self.activity_cache.get(activity_number)
+        self.forget_activity(activity_number)
+        if old is None:
+            return []
+        return self.find_changed_students(old, self.get_activity(activity_number))
+    
+    def forget_activity(self, activity_number):
+        """ Removes an activity, and everything compiled from it, from memory. """
+        self.activity_cache.pop(activity_number, None)
+        self.activity_models.pop(activity_number, None)
+        for key in [key for key in self.report_templates if key[0] == activity_number]:
+            del self.report_templates[key]
+    
+    def find_changed_students(self, old, new):
+        """ 
+        Compares two versions of the parsed data of an activity (see parse_activity), 
+        and returns the students of the new version whose points or comments differ. 
+        """
+        students = list(new["points"].columns[self.ncols_criteria:])
+        for key in ["points", "comments"]:
+            df_old, df_new = old[key], new[key]
+            criteria_cols = list(df_new.columns[:self.ncols_criteria])
+            if list(df_old.columns[:self.ncols_criteria]) != criteria_cols or \
+                    not df_old.index.equals(df_new.index) or \
+                    not df_old[criteria_cols].equals(df_new[criteria_cols]):
+                return students
+        
+        return [student for student in students 
+                if any(student not in old[key].columns or 
+                       not old[key][student].equals(new[key][student]) 
+                       for key in ["points", "comments"])]
+    
+    def validate_scores(self, activity_number):
+        """ 
+        Checks the points of all students for an activity at once. Finds missing or 
+        non-numeric points, points outside [min_score, max_score], and rows where the 
+        criteria in the points and comments sections don't match.
+        """
+        df_raw = self.get_points(activity_number, include_evaluation_criteria = False)
+        scores = self.get_points_matrix(activity_number)
+        students = list(df_raw.columns)
+        criteria = self.get_points(activity_number, include_evaluation_criteria = True)[self.str_criterion_theme].values
+        
+        missing = np.isnan(scores)
+        out_of_range = ~missing & ((scores < self.min_score) | (scores > self.max_score))
+        
+        # Transpose, so that the problems are listed student by student
+        bad_cells = [(students[j], criteria[i], df_raw.iat[i, j]) 
+                     for j, i in zip(*np.nonzero(missing.T))]
+        out_of_range_cells = [(students[j], criteria[i], df_raw.iat[i, j]) 
+                              for j, i in zip(*np.nonzero(out_of_range.T))]
+        
+        # The points and comments are matched by position, so their criteria must be 
+        # listed in the same order.
+        cols = [self.str_category, self.str_criterion_theme]
+        keys_points = [tuple(x) for x in self.get_points(activity_number, True)[cols].fillna("").values]
+        keys_comments = [tuple(x) for x in self.get_comments(activity_number, True)[cols].fillna("").values]
+        n = max(len(keys_points), len(keys_comments))
+        keys_points += [None] * (n - len(keys_points))
+        keys_comments += [None] * (n - len(keys_comments))
+        ordering_mismatches = [(i, x, y) for i, (x, y) in enumerate(zip(keys_points, keys_comments)) 
+                               if x != y]
+        
+        return ValidationReport(activity_number, students, bad_cells, out_of_range_cells, 
+                                ordering_mismatches, self.min_score, self.max_score, 
+                                merge_conflicts = self.get_activity(activity_number).get("merge_conflicts", []))
+    
+    def cohort_summary(self, activity_number, weights = None, percentiles = (25, 75)):
+        """ 
+        Statistics of the points of all students for an activity, computed on the 
+        whole points matrix at once: the distribution of the points on each criterion 
+        and category, the number of students at each achievement level on each 
+        criterion, and the weighted score ("Vektet score") of each student. Missing 
+        and out of range points are left out of the statistics. 
+        
+        weights are the weights of the criteria, either one per criterion (in the order 
+        of get_points) or a dictionary with the weight of the criteria in each category 
+        (1 for categories not in the dictionary). All criteria have the same weight by 
+        default. The weighted score is on the same scale as the points, and is missing 
+        for students with missing points. Returns a CohortSummary.
+        """
+        df_points = self.get_points(activity_number, include_evaluation_criteria = True)
+        categories = df_points[self.str_category].values
+        criteria = df_points[self.str_criterion_theme].values
+        students = list(self.get_students(activity_number))
+        
+        scores = self.get_points_matrix(activity_number)
+        scores = np.where((scores < self.min_score) | (scores > self.max_score), np.nan, scores)
+        df_scores = pd.DataFrame(scores, columns = students)
+        
+        # Distribution of the points on each criterion
+        criterion_stats = self.describe_scores(df_scores, percentiles)
+        criterion_stats.insert(0, self.str_criterion_theme, criteria)
+        criterion_stats.insert(0, self.str_category, categories)
+        
+        # Each student's average on each category, and the distribution of those
+        category_scores = df_scores.groupby(pd.Index(categories, name = self.str_category), 
+                                            sort = False).mean()
+        category_stats = self.describe_scores(category_scores, percentiles).reset_index()
+        
+        # Number of students at each achievement level on each criterion
+        level_codes = self.classify_achievement_levels(scores)
+        level_labels = self.get_combined_achievement_level_labels()[0]
+        level_counts = pd.DataFrame(np.stack([(level_codes == i).sum(axis = 1) 
+                                              for i in range(len(level_labels))], axis = 1), 
+                                    columns = level_labels)
+        level_counts.insert(0, self.str_criterion_theme, criteria)
+        level_counts.insert(0, self.str_category, categories)
+        
+        w = self.get_criterion_weights(categories, weights)
+        weighted_scores = pd.Series(w @ scores / w.sum(), 
+                                    index = students, name = self.str_table_normalised_score)
+        
+        student_scores = category_scores.T
+        student_scores[self.str_table_normalised_score] = weighted_scores
+        total_stats = self.describe_scores(student_scores[[self.str_table_normalised_score]].T, 
+                                           percentiles).rename_axis(self.str_table_score)
+        return CohortSummary(activity_number, students, criterion_stats, category_stats, 
+                             level_counts, student_scores, total_stats)
+    
+    def describe_scores(self, df_scores, percentiles = (25, 75)):
+        """ 
+        Statistics of each row of df_scores (one column per student), ignoring missing 
+        scores. Returns a dataframe with one row per row of df_scores.
+        """
+        stats = pd.DataFrame({self.str_count: df_scores.count(axis = 1), 
+                              self.str_mean: df_scores.mean(axis = 1), 
+                              self.str_median: df_scores.median(axis = 1)})
+        for p in percentiles:
+            stats[f"{p}. {self.str_percentile}"] = df_scores.quantile(p / 100, axis = 1)
+        stats[self.str_min] = df_scores.min(axis = 1)
+        stats[self.str_max] = df_scores.max(axis = 1)
+        return stats
+    
+    def get_criterion_weights(self, categories, weights = None):
+        """ The weight of each criterion, given as in cohort_summary. """
+        if weights is None:
+            return np.ones(len(categories))
+        if isinstance(weights, dict):
+            return np.array([weights.get(category, 1) for category in categories], dtype = float)
+        
+        weights = np.asarray(weights, dtype = float)
+        if weights.shape != (len(categories),):
+            raise AssertionError(f"Expected {len(categories)} weights (one per criterion), " + \
+                                 f"got {len(weights)}.")
+        return weights
+    
+    def make_cohort_report(self, summary):
+        """ Formats a CohortSummary as a markdown report for the instructor. """
+        parts = [''.join(["# ", self.str_cohort_report, " i ", self.str_course_code, ", ", 
+                          self.str_course_semester, " aktivitet ", str(summary.activity_number), 
+                          "\n\n"])]
+        
+        parts.append("## " + self.str_summary + "\n\n")
+        parts.append(make_markdown_table(summary.total_stats.reset_index()) + "\n\n")
+        
+        parts.append("## " + self.str_category + "\n\n")
+        parts.append(make_markdown_table(summary.category_stats) + "\n\n")
+        
+        parts.append("## " + self.str_criterion_theme + "\n\n")
+        parts.append(make_markdown_table(summary.criterion_stats) + "\n\n")
+        
+        parts.append("## " + self.str_achievement + "\n\n")
+        parts.append(make_markdown_table(summary.level_counts) + "\n\n")
+        
+        parts.append("\\pagebreak\n\n## " + self.str_table_normalised_score + "\n\n")
+        parts.append(make_markdown_table(summary.student_scores.rename_axis(self.str_student)
+                                         .reset_index()) + "\n")
+        return "".join(parts)
+    
+    def generate_cohort_report(self, activity_number, weights = None, formats = None, 
+                               temp = False, timestamp = True):
+        """ 
+        Writes the cohort summary of an activity (see cohort_summary) as a report for 
+        the instructor in the given formats (see get_export_formats), together with 
+        the statistics of each criterion and the scores of each student as csv files. 
+        The files are placed in the folder of the activity. Returns the file name of 
+        the first format.
+        """
+        formats = self.get_export_formats(formats)
+        summary = self.cohort_summary(activity_number, weights = weights)
+        
+        path = self.get_activity_path(activity_number, temp = temp)
+        self.make_dir(path)
+        fn = path + self.str_cohort_report + "_" + self.str_course_code + "_" + \
+            self.str_course_semester + "_" + self.str_activity + "_" + str(activity_number)
+        if timestamp:
+            fn += strftime("_%Y%m%d_%H%M%S", gmtime())
+        
+        summary.criterion_stats.to_csv(fn + "_" + self.str_criterion_theme + ".csv", index = False)
+        summary.student_scores.rename_axis(self.str_student).to_csv(fn + "_" + self.str_student + ".csv")
+        export_report(self.make_cohort_report(summary), fn, self.get_render_profile(), 
+                      formats = formats, timer = self.timer)
+        return fn + "." + formats[0]
+    
+    def get_rubric_hash(self, activity_number, **kwargs):
+        """ 
+        Hash of everything that affects all reports for an activity: the criteria and 
+        generic comment columns, the pandoc configuration and the report settings. 
+        """
+        h = hashlib.sha256()
+        for df in [self.get_points(activity_number, include_evaluation_criteria = True), 
+                   self.get_comments(activity_number, include_evaluation_criteria = True)]:
+            h.update(df[df.columns[:self.ncols_criteria]].to_json().encode("utf-8"))
+        
+        h.update(json.dumps(self.get_pandoc_args(toc = kwargs.get("toc", False))).encode("utf-8"))
+        for fn in [self.fn_header, self.fn_after_body]:
+            if os.path.isfile(fn):
+                with open(fn, "rb") as f:
+                    h.update(f.read())
+        
+        # The timestamp only changes the file name, not the report itself
+        settings = {key: value for key, value in kwargs.items() if key != "timestamp"}
+        h.update(json.dumps([self.str_course_code, self.str_course_semester, activity_number, 
+                             sorted(settings.items())]).encode("utf-8"))
+        return h.hexdigest()
+    
+    def get_student_hash(self, student, activity_number, str_rubric_hash):
+        """ Hash of a student's points and comments, combined with the rubric hash. """
+        model = self.get_activity_model(activity_number)
+        h = hashlib.sha256(str_rubric_hash.encode("utf-8"))
+        h.update(student.encode("utf-8"))
+        for values in [model.get_student_points(student), model.get_student_comments(student)]:
+            h.update(pd.Series(values).to_json(orient = "values").encode("utf-8"))
+        return h.hexdigest()
+    
+    def get_build_manifest_filename(self, activity_number, temp = False):
+        return self.get_activity_path(activity_number, temp = temp) + self.fn_manifest
+    
+    def read_build_manifest(self, activity_number, temp = False):
+        """ 
+        Reads the build manifest of an activity, which maps each student to the hash 
+        of the data their latest report was generated from and the file name of that 
+        report. 
+        """
+        fn = self.get_build_manifest_filename(activity_number, temp = temp)
+        if not os.path.isfile(fn):
+            return {}
+        with open(fn, "r", encoding = "utf-8") as f:
+            return json.load(f)
+    
+    def write_build_manifest(self, manifest, activity_number, temp = False):
+        fn = self.get_build_manifest_filename(activity_number, temp = temp)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        
+        # Write to a temporary file first, so that an interrupted run never leaves 
+        # a truncated manifest behind.
+        with open(fn + ".tmp", "w", encoding = "utf-8") as f:
+            json.dump(manifest, f, indent = 1, ensure_ascii = False, sort_keys = True)
+        os.replace(fn + ".tmp", fn)
+    
+    def is_report_up_to_date(self, manifest, student, str_hash):
+        entry = manifest.get(student)
+        return entry is not None and entry["hash"] == str_hash and os.path.isfile(entry["report"])
+    
+    def get_latest_report(self, student, activity_number, temp = False):
+        """ 
+        Returns the file name of the latest pdf report generated for a student, or 
+        None if there is none. Reports are looked up in the build manifest first, and 
+        otherwise among the (possibly timestamped) pdfs in the student's folder.
+        """
+        entry = self.read_build_manifest(activity_number, temp = temp).get(student)
+        if entry is not None and os.path.isfile(entry["report"]):
+            return entry["report"]
+        
+        # Timestamps are formatted as _%Y%m%d_%H%M%S, so they sort chronologically
+        path = self.get_activity_path(activity_number, temp = temp) + student + "/"
+        fns = sorted(glob.glob(glob.escape(path) + "*.pdf"))
+        return fns[-1] if fns else None
+    
+    def export_reports(self, exports, activity_number, workers = 1, temp = False, 
+                       timestamp = True, remove_temp_files = True, toc = False, formats = None):
+        """ 
+        Export already generated reports, given as (student, EvaluationReport) pairs, using 
+        a pool of worker processes. Results are reported in the order the reports are 
+        given, regardless of the order in which the conversions finish. Returns a 
+        dictionary with the file names of the reports that were successfully exported.
+        """
+        formats = self.get_export_formats(formats, remove_temp_files)
+        exported = {}
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = []
+            fn_students = []
+            for student, report in exports:
+                fn_student, profile = self.prepare_report_export(student, activity_number, 
+                                                                 temp = temp, 
+                                                                 timestamp = timestamp, 
+                                                                 toc = toc)
+                fn_students.append(fn_student)
+                futures.append(pool.submit(export_report_in_worker, report, fn_student, 
+                                           profile, formats, self.timer.enabled, student))
+                
+            for (student, report), fn_student, future in zip(exports, fn_students, futures):
+                try:
+                    self.timer.merge(future.result())
+                    exported[student] = fn_student + "." + formats[0]
+                    print(f"SUCCESS: generated report for {student}")
+                except Exception as e:
+                    print(f"Export failed for {student}")
+                    print(e)
+        return exported
+
+    
+    def export_reports_batch(self, exports, activity_number, temp = False, 
+                             timestamp = True, remove_temp_files = True, toc = False, 
+                             formats = None):
+        """ 
+        Export already generated reports, given as (student, EvaluationReport) pairs, as a 
+        single pandoc/LaTeX job, so that the LaTeX preamble is only processed once 
+        per activity. Each report starts on a new page with a named anchor, which is 
+        used to split the combined pdf into the usual per-student files. Returns a 
+        dictionary with the file names of the pdfs that were successfully exported. 
+        Other formats than pdf are exported separately for each student.
+        """
+        formats = self.get_batch_export_formats(formats, remove_temp_files, toc)
+        from pypdf import PdfReader, PdfWriter
+        
+        fn_students = []
+        for student, report in exports:
+            fn_student, profile = self.prepare_report_export(student, activity_number, 
+                                                             temp = temp, 
+                                                             timestamp = timestamp)
+            fn_students.append(fn_student)
+            export_report(report, fn_student, profile, 
+                          formats = [x for x in formats if x != "pdf"], 
+                          timer = self.timer, student = student)
+        
+        fn_batch = self.get_activity_path(activity_number, temp = temp) + \
+            self.get_activity_report_name(activity_number) + "_batch"
+        if timestamp: 
+            fn_batch += strftime("_%Y%m%d_%H%M%S", gmtime())
+        
+        # Restart page numbering for each student, so that the split reports are 
+        # identical to the ones exported one by one.
+        str_batch = "".join(["```{=latex}\n\\clearpage\n\\setcounter{page}{1}\n" + \
+                             "\\hypertarget{" + self.get_batch_anchor(i) + "}{}\n```\n\n" + \
+                             report.markdown + "\n\n" for i, (student, report) in enumerate(exports)])
+        try:
+            with self.timer.span("pdf batch"):
+                export_report(str_batch, fn_batch, profile, formats = ["pdf"])
+        except Exception as e:
+            print(f"Batch export failed for activity {activity_number}, exporting the reports one by one")
+            print(e)
+            return self.export_reports_separately(exports, fn_students, profile)
+        
+        reader = PdfReader(fn_batch + ".pdf")
+        destinations = reader.named_destinations
+        
+        exported = {}
+        start_pages = []
+        for i, (student, report) in enumerate(exports):
+            anchor = self.get_batch_anchor(i)
+            if anchor in destinations:
+                start_pages.append(reader.get_destination_page_number(destinations[anchor]))
+            else:
+                start_pages.append(None)
+        
+        for i, ((student, report), fn_student) in enumerate(zip(exports, fn_students)):
+            end_pages = [p for p in start_pages[(i + 1):] if p is not None]
+            end_page = end_pages[0] if end_pages else len(reader.pages)
+            
+            if start_pages[i] is None or end_page <= start_pages[i]:
+                print(f"Export failed for {student}")
+                print("Could not locate the report in the combined pdf.")
+                continue
+            
+            with self.timer.span("split pdf", student):
+                writer = PdfWriter()
+                for page in reader.pages[start_pages[i]:end_page]:
+                    writer.add_page(page)
+                with open(fn_student + ".pdf", "wb") as f:
+                    writer.write(f)
+            self.timer.count("pdf")
+            exported[student] = fn_student + ".pdf"
+            print(f"SUCCESS: generated report for {student}")
+        
+        os.remove(fn_batch + ".pdf")
+        return exported
+    
+    def export_reports_separately(self, exports, fn_students, profile):
+        """ 
+        Exports the pdf of each report on its own, e.g. when a report makes the batch 
+        export fail. Returns a dictionary with the file names of the pdfs that were 
+        successfully exported.
+        """
+        exported = {}
+        for (student, report), fn_student in zip(exports, fn_students):
+            try:
+                export_report(report, fn_student, profile, formats = ["pdf"], 
+                              timer = self.timer, student = student)
+                exported[student] = fn_student + ".pdf"
+                print(f"SUCCESS: generated report for {student}")
+            except Exception as e:
+                print(f"Export failed for {student}")
+                print(e)
+        return exported
+    
+    def get_batch_export_formats(self, formats = None, remove_temp_files = True, toc = False):
+        """ As get_export_formats, but checks that the reports can be exported in batch. """
+        formats = self.get_export_formats(formats, remove_temp_files)
+        if toc:
+            raise AssertionError("Tables of contents are not supported when exporting reports in batch.")
+        if "pdf" not in formats:
+            raise AssertionError("Reports can only be exported in batch to pdf.")
+        return formats
+    
+    def get_batch_anchor(self, i):
+        """ Name of the pdf anchor marking the start of the i-th report in a batch. """
+        return "report-" + str(i)
+
+
+def export_report(report, fn_student, profile, formats = ("pdf",), timer = None, 
+                  student = None):
+    """ 
+    Writes a report, given as an EvaluationReport or a markdown string, to fn_student 
+    with the extension of each of the requested formats ("pdf", "html" and/or "md"). 
+    The markdown is passed to pandoc through stdin, so no intermediate files are 
+    written. Formats that an EvaluationReport has already rendered are not rendered 
+    again. This is a module level function so that it can be run in worker processes 
+    without pickling the Evaluator. The time spent on each format is recorded in 
+    timer, if given. Returns the file names that were written.
+    """
+    if not isinstance(report, EvaluationReport):
+        report = EvaluationReport.from_markdown(report, profile)
+    str_report = report.markdown
+    timer = timer or null_timer
+    fns = []
+    if "md" in formats:
+        with timer.span("write md", student):
+            with open(fn_student + ".md", "w", encoding = "utf-8") as f:
+                f.write(str_report)
+        timer.count("md")
+        fns.append(fn_student + ".md")
+    
+    if "html" in formats:
+        with timer.span("html", student):
+            html = report.html
+            with codecs.open(fn_student + ".html", "w", encoding="latin-1",errors="xmlcharrefreplace") as f:
+                f.write(html)
+        timer.count("html")
+        fns.append(fn_student + ".html")
+    
+    if "pdf" in formats:
+        with timer.span("pdf", student):
+            report.write_pdf(fn_student + ".pdf", profile)
+        timer.count("pdf")
+        fns.append(fn_student + ".pdf")
+    return fns
+
+
+def stream_to_archive(archive, filename, arcname, chunk_size = 1 << 20):
+    """ 
+    Copies a file into an open zip archive in chunks, and deletes it. Returns the 
+    SHA-256 of the file. 
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as src, archive.open(arcname, "w") as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b""):
+            h.update(chunk)
+            dst.write(chunk)
+    os.remove(filename)
+    return h.hexdigest()
+
+
+def export_report_in_worker(report, fn_student, profile, formats, timing, student):
+    """ 
+    Runs export_report in a worker process. Returns what the worker's timer recorded, 
+    to be merged into the timer of the Evaluator (see Timer.merge).
+    """
+    timer = Timer(enabled = timing)
+    export_report(report, fn_student, profile, formats = formats, timer = timer, 
+                  student = student)
+    return timer.get_records()
+
+
+async def export_report_async(report, fn_student, profile, formats = ("pdf",), 
+                              timer = None, student = None):
+    """ 
+    As export_report, but the pdf is converted with subprocesses that can be killed 
+    (see RenderProfile.convert_to_pdf_async). Returns the file names that were written.
+    """
+    timer = timer or null_timer
+    fns = export_report(report, fn_student, profile, 
+                        formats = [x for x in formats if x != "pdf"], 
+                        timer = timer, student = student)
+    if "pdf" in formats:
+        with timer.span("pdf", student):
+            await profile.convert_to_pdf_async(str(report), fn_student + ".pdf")
+        timer.count("pdf")
+        fns.append(fn_student + ".pdf")
+    return fns
+
+
+async def run_process_async(args, input = None, cwd = None, env = None):
+    """ 
+    Runs a command as a subprocess and returns its output. Raises a RuntimeError if 
+    the command fails. If the coroutine is cancelled, the process and any processes 
+    it has started (e.g. the LaTeX engine started by pandoc) are killed.
+    """
+    import asyncio
+    
+    process = await asyncio.create_subprocess_exec(*args, stdin = asyncio.subprocess.PIPE, 
+                                                   stdout = asyncio.subprocess.PIPE, 
+                                                   stderr = asyncio.subprocess.PIPE, 
+                                                   cwd = cwd, env = env, 
+                                                   start_new_session = os.name == "posix")
+    try:
+        stdout, stderr = await process.communicate(input)
+    except asyncio.CancelledError:
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        raise
+    
+    if process.returncode != 0:
+        raise RuntimeError(os.path.basename(args[0]) + " failed:\n" + \
+                           (stderr or stdout).decode("utf-8", errors = "replace")[-2000:])
+    return stdout
+
+
+class RenderProfile():
+    """ 
+    Settings for converting reports to pdf: an immutable tuple of pandoc arguments 
+    and, once precompile has succeeded, a LaTeX format file containing the preamble 
+    shared by all reports. With a format file, pandoc only converts the markdown to 
+    LaTeX, and the LaTeX engine is run directly with the precompiled preamble, so the 
+    packages in the preamble are loaded once instead of once per report.
+    
+    Instances are picklable, so that they can be passed to worker processes.
+    """
+    def __init__(self, pandoc_args):
+        self.pandoc_args = tuple(pandoc_args)
+        self.engine = "xelatex"
+        for arg in self.pandoc_args:
+            if arg.startswith("--pdf-engine="):
+                self.engine = arg.split("=", 1)[1]
+        self.preamble = None
+        self.dump_position = None
+        self.format_file = None
+    
+    def convert_to_pdf(self, str_report, fn_pdf):
+        """ 
+        Converts a report to pdf, with the precompiled preamble if there is one. If the 
+        report can't be compiled with the precompiled preamble, it is converted by 
+        pandoc as usual.
+        """
+        if self.format_file is not None:
+            tex = self.convert_to_latex(str_report)
+            if self.has_precompiled_preamble(tex):
+                try:
+                    return self.compile_latex(tex, fn_pdf)
+                except (RuntimeError, OSError) as e:
+                    print(e)
+                    print("Could not compile the report with the precompiled preamble, converting it with pandoc.")
+        
+        import pypandoc
+        pypandoc.convert_text(str_report, 'pdf', format="markdown",
+                              outputfile = fn_pdf, 
+                              extra_args = list(self.pandoc_args))
+    
+    async def convert_to_pdf_async(self, str_report, fn_pdf):
+        """ 
+        As convert_to_pdf, but runs pandoc and the LaTeX engine as subprocesses, which 
+        are killed if the coroutine is cancelled (e.g. when it times out).
+        """
+        source = str_report.encode("utf-8")
+        if self.format_file is not None:
+            tex = await run_process_async(self.get_pandoc_command("latex") + ["--standalone"], 
+                                          input = source)
+            tex = tex.decode("utf-8")
+            if self.has_precompiled_preamble(tex):
+                try:
+                    return await self.compile_latex_async(tex, fn_pdf)
+                except (RuntimeError, OSError) as e:
+                    print(e)
+                    print("Could not compile the report with the precompiled preamble, converting it with pandoc.")
+        
+        await run_process_async(self.get_pandoc_command("latex") + ["--output=" + fn_pdf], 
+                                input = source)
+    
+    def convert_to_latex(self, str_report):
+        import pypandoc
+        return pypandoc.convert_text(str_report, 'latex', format="markdown", 
+                                     extra_args = list(self.pandoc_args) + ["--standalone"])
+    
+    def get_pandoc_command(self, to):
+        """ Command line for converting markdown from stdin with pandoc. """
+        import pypandoc
+        return [pypandoc.get_pandoc_path(), "--from=markdown", "--to=" + to] + list(self.pandoc_args)
+    
+    def has_precompiled_preamble(self, tex):
+        """ 
+        Some pandoc template variables depend on the content of the report, so the 
+        precompiled preamble can only be used if the preamble of tex is identical.
+        """
+        return tex[:len(self.preamble)] == self.preamble and \
+            tex[len(self.preamble):].startswith("\\begin{document}")
+    
+    def insert_endofdump(self, tex):
+        """ Marks where the precompiled part of the preamble ends (mylatexformat). """
+        if self.dump_position is None:
+            return tex
+        return tex[:self.dump_position] + "\\endofdump\n" + tex[self.dump_position:]
+    
+    def find_font_setup(self, preamble):
+        """ 
+        XeTeX and LuaTeX can't store fonts loaded through fontspec in a format file, so 
+        find the start of the line where the font setup begins. 
+        """
+        positions = [preamble.find(x) for x in ["\\usepackage{iftex}", "\\ifPDFTeX", 
+                                                "unicode-math", "fontspec", "sourcesanspro"]]
+        positions = [x for x in positions if x >= 0]
+        if not positions:
+            return None
+        return preamble.rfind("\n", 0, min(positions)) + 1
+    
+    def precompile(self, str_report, format_dir):
+        """ 
+        Precompiles the preamble pandoc generates for str_report into a format file in 
+        format_dir, using the mylatexformat package. First tries to precompile the 
+        whole preamble, then only the part before the font setup. A format file is 
+        only used if str_report can be compiled with it. Returns whether a usable 
+        format file could be made.
+        """
+        tex = self.convert_to_latex(str_report)
+        preamble = tex[:tex.index("\\begin{document}")]
+        name = "report_preamble_" + hashlib.sha256(preamble.encode("utf-8")).hexdigest()[:16]
+        
+        for dump_position in [None, self.find_font_setup(preamble)]:
+            self.preamble = preamble
+            self.dump_position = dump_position
+            fn_format = os.path.join(format_dir, name + ("" if dump_position is None else "_partial"))
+            if not os.path.isfile(fn_format + ".fmt"):
+                with open(fn_format + ".tex", "w", encoding = "utf-8") as f:
+                    f.write(self.insert_endofdump(preamble) + "\\begin{document}\n\\end{document}\n")
+                try:
+                    subprocess.run([self.engine, "-ini", "-interaction=nonstopmode", 
+                                    "-jobname=" + os.path.basename(fn_format), 
+                                    "&" + self.engine, "mylatexformat.ltx", 
+                                    os.path.basename(fn_format) + ".tex"], 
+                                   cwd = format_dir, capture_output = True, timeout = 600)
+                except (OSError, subprocess.SubprocessError):
+                    break
+            if os.path.isfile(fn_format + ".fmt"):
+                self.format_file = fn_format + ".fmt"
+                try:
+                    with tempfile.TemporaryDirectory() as tmpdir:
+                        self.compile_latex(tex, os.path.join(tmpdir, "sample.pdf"))
+                    return True
+                except (RuntimeError, OSError) as e:
+                    print(e)
+                    # Don't reuse the format file in later runs
+                    os.remove(self.format_file)
+                    self.format_file = None
+        
+        self.preamble = None
+        self.dump_position = None
+        return False
+    
+    def compile_latex(self, tex, fn_pdf, max_runs = 3):
+        """ Runs the LaTeX engine on tex with the precompiled preamble, and copies the pdf to fn_pdf. """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "report.tex"), "w", encoding = "utf-8") as f:
+                f.write(self.insert_endofdump(tex))
+            
+            # Rerun as pandoc does, until cross references (e.g. longtable widths) are stable
+            for i in range(max_runs):
+                result = subprocess.run(self.get_latex_command(), cwd = tmpdir, 
+                                        env = self.get_latex_env(), capture_output = True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"{self.engine} failed:\n" + \
+                                       result.stdout.decode("utf-8", errors = "replace")[-2000:])
+                if not self.needs_rerun(tmpdir):
+                    break
+            shutil.copyfile(os.path.join(tmpdir, "report.pdf"), fn_pdf)
+    
+    async def compile_latex_async(self, tex, fn_pdf, max_runs = 3):
+        """ As compile_latex, but runs the LaTeX engine with run_process_async. """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "report.tex"), "w", encoding = "utf-8") as f:
+                f.write(self.insert_endofdump(tex))
+            
+            for i in range(max_runs):
+                await run_process_async(self.get_latex_command(), cwd = tmpdir, 
+                                        env = self.get_latex_env())
+                if not self.needs_rerun(tmpdir):
+                    break
+            shutil.copyfile(os.path.join(tmpdir, "report.pdf"), fn_pdf)
+    
+    def get_latex_command(self):
+        """ Command line for compiling report.tex with the precompiled preamble. """
+        return [self.engine, "-interaction=nonstopmode", "-halt-on-error", 
+                "-fmt=" + os.path.splitext(os.path.basename(self.format_file))[0], "report.tex"]
+    
+    def get_latex_env(self):
+        """ Environment in which the LaTeX engine finds the format file. """
+        return dict(os.environ, TEXFORMATS = os.path.dirname(self.format_file) + os.pathsep)
+    
+    def needs_rerun(self, tmpdir):
+        with open(os.path.join(tmpdir, "report.log"), "rb") as f:
+            return b"Rerun" in f.read()
+
+
+class Timer():
+    """ 
+    Records the wall and CPU time spent in named spans of the report pipeline, e.g. 
+    parsing the workbook, generating the markdown of a student, or converting it to 
+    pdf, together with the number of files written per format. 
+    
+        with timer.span("pdf", student):
+            ...
+    
+    When the timer is disabled, span returns a shared no-op context manager, so 
+    the instrumentation costs next to nothing. CPU time is measured for the whole 
+    process, so it is only meaningful for spans that don't overlap (i.e. not for 
+    the subprocesses started by generate_reports_async). 
+    """
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.reset()
+    
+    def reset(self):
+        # (name, student, start, wall time, cpu time, pid)
+        self.spans = []
+        self.file_counts = {}
+    
+    def span(self, name, student = None):
+        if not self.enabled:
+            return null_span
+        return TimerSpan(self, name, student)
+    
+    def count(self, name, n = 1):
+        """ Counts the files written in a format. """
+        if self.enabled:
+            self.file_counts[name] = self.file_counts.get(name, 0) + n
+    
+    def get_records(self):
+        return {"spans": self.spans, "file_counts": self.file_counts}
+    
+    def mark(self):
+        """ The current position in the records, to summarise only what is recorded after it. """
+        return len(self.spans), dict(self.file_counts)
+    
+    def get_spans(self, since = None):
+        return self.spans if since is None else self.spans[since[0]:]
+    
+    def get_file_counts(self, since = None):
+        if since is None:
+            return self.file_counts
+        counts = {name: n - since[1].get(name, 0) for name, n in self.file_counts.items()}
+        return {name: n for name, n in counts.items() if n}
+    
+    def merge(self, records):
+        """ Adds what another timer (e.g. one in a worker process) has recorded. """
+        if records is None:
+            return
+        self.spans += records["spans"]
+        for name, n in records["file_counts"].items():
+            self.count(name, n)
+    
+    def get_stage_times(self, since = None):
+        """ Number of spans, total wall time, total CPU time and maximum wall time of each stage. """
+        stages = {}
+        for name, student, start, wall, cpu, pid in self.get_spans(since):
+            calls, total_wall, total_cpu, max_wall = stages.get(name, (0, 0., 0., 0.))
+            stages[name] = (calls + 1, total_wall + wall, total_cpu + cpu, max(max_wall, wall))
+        return stages
+    
+    def get_student_times(self, since = None):
+        """ Total wall and CPU time spent on each student. """
+        students = {}
+        for name, student, start, wall, cpu, pid in self.get_spans(since):
+            if student is not None:
+                total_wall, total_cpu = students.get(student, (0., 0.))
+                students[student] = (total_wall + wall, total_cpu + cpu)
+        return students
+    
+    def summary(self, n_students = 5, since = None):
+        """ 
+        Table of the time spent in each stage, followed by the slowest students. If 
+        since is given (see mark), only what was recorded after it is included.
+        """
+        lines = ["", f"{'Stage':<18}{'calls':>7}{'wall (s)':>11}{'cpu (s)':>11}{'mean (ms)':>11}{'max (ms)':>11}"]
+        for name, (calls, wall, cpu, max_wall) in self.get_stage_times(since).items():
+            lines.append(f"{name:<18}{calls:>7}{wall:>11.3f}{cpu:>11.3f}" + \
+                         f"{wall / calls * 1e3:>11.1f}{max_wall * 1e3:>11.1f}")
+        
+        file_counts = self.get_file_counts(since)
+        if file_counts:
+            lines.append("Files written: " + ", ".join([f"{n} {name}" 
+                                                        for name, n in file_counts.items()]))
+        
+        slowest = sorted(self.get_student_times(since).items(), key = lambda x: -x[1][0])[:n_students]
+        if slowest:
+            lines.append("Slowest students:")
+            for student, (wall, cpu) in slowest:
+                lines.append(f"  {student}: {wall:.3f} s wall, {cpu:.3f} s cpu")
+        return "\n".join(lines) + "\n"
+    
+    def write_trace(self, filename):
+        """ 
+        Writes the spans in the trace event format, which can be opened in e.g. 
+        chrome://tracing or https://ui.perfetto.dev. 
+        """
+        events = []
+        for name, student, start, wall, cpu, pid in self.spans:
+            events.append({"name": name, "cat": "report", "ph": "X", "pid": pid, "tid": pid, 
+                           "ts": start * 1e6, "dur": wall * 1e6, 
+                           "args": {"student": student, "cpu_ms": cpu * 1e3}})
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "otherData": {"file_counts": self.file_counts}}, f)
+
+
+class TimerSpan():
+    __slots__ = ["timer", "name", "student", "start", "start_cpu"]
+    
+    def __init__(self, timer, name, student):
+        self.timer = timer
+        self.name = name
+        self.student = student
+    
+    def __enter__(self):
+        self.start = perf_counter()
+        self.start_cpu = process_time()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.timer.spans.append((self.name, self.student, self.start, 
+                                 perf_counter() - self.start, 
+                                 process_time() - self.start_cpu, os.getpid()))
+
+
+null_span = contextlib.nullcontext()
+null_timer = Timer()
+
+
+class ReportTemplate():
+    """ 
+    The parts of a report that are the same for all students, stored as static text 
+    interleaved with named slots. A slot (name, i) is filled in with values[name][i] 
+    when the template is rendered, so that a report is assembled with a single join.
+    """
+    __slots__ = ["static", "slots"]
+    
+    def __init__(self):
+        self.static = [[]]
+        self.slots = []
+    
+    def add_text(self, text):
+        self.static[-1].append(text)
+    
+    def add_slot(self, name, i = 0):
+        self.slots.append((name, i))
+        self.static.append([])
+    
+    def compile(self):
+        """ Joins the static text between the slots. Returns the template. """
+        self.static = tuple("".join(x) for x in self.static)
+        self.slots = tuple(self.slots)
+        return self
+    
+    def render(self, values):
+        parts = [None] * (2 * len(self.slots) + 1)
+        parts[0::2] = self.static
+        parts[1::2] = [values[name][i] for name, i in self.slots]
+        return "".join(parts)
+
+
+class ActivityData():
+    """ 
+    Read-only sequence with one item per activity, in the order of the evaluator's 
+    activity numbers. Items are taken from Evaluator.get_activity, so an activity is 
+    only parsed when one of its items is first accessed.
+    """
+    def __init__(self, evaluator, key):
+        self.evaluator = evaluator
+        self.key = key
+    
+    def __getitem__(self, i):
+        return self.evaluator.get_activity(self.evaluator.activity_numbers[i])[self.key]
+    
+    def __len__(self):
+        return len(self.evaluator.activity_numbers)
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class ActivityModel():
+    """ 
+    Compiled, read-only representation of the rubric and results of an activity. 
+    
+    criteria holds the named criteria in the order they appear in the reports, and 
+    category_ranges holds (category, start, stop) tuples such that 
+    criteria[start:stop] are the criteria of that category. Points, comments and 
+    generic comments are indexed by the same running criterion index. 
+    
+    level_codes and color_codes hold the classified points of all students (one row 
+    per criterion, one column per student), which index the precomputed 
+    level_labels, colored_level_labels[level][color] and 
+    combined_generic_comments[criterion][level].
+    """
+    __slots__ = ["activity_number", "students", "student_index", "criteria", 
+                 "category_ranges", "table_categories", "table_criteria", 
+                 "level_index", "generic_comments", "student_points", "student_comments", 
+                 "level_codes", "color_codes", "level_labels", "colored_level_labels", 
+                 "combined_generic_comments"]
+    
+    def __init__(self, activity_number, students, criteria, category_ranges, 
+                 table_categories, table_criteria, levels, generic_comments, 
+                 student_points, student_comments, level_codes, color_codes, 
+                 level_labels, colored_level_labels, combined_generic_comments):
+        self.activity_number = activity_number
+        self.students = tuple(students)
+        self.student_index = {student: i for i, student in enumerate(self.students)}
+        self.criteria = tuple(criteria)
+        self.category_ranges = tuple(category_ranges)
+        self.table_categories = read_only(table_categories)
+        self.table_criteria = read_only(table_criteria)
+        self.level_index = {level: i for i, level in enumerate(levels)}
+        self.generic_comments = read_only(generic_comments)
+        
+        # Kept per student, as each column has its own dtype in the workbook
+        self.student_points = tuple(read_only(x) for x in student_points)
+        self.student_comments = tuple(read_only(x) for x in student_comments)
+        self.level_codes = read_only(level_codes)
+        self.color_codes = read_only(color_codes)
+        self.level_labels = tuple(level_labels)
+        self.colored_level_labels = tuple(tuple(x) for x in colored_level_labels)
+        self.combined_generic_comments = combined_generic_comments
+    
+    def get_student_points(self, student):
+        return self.student_points[self.student_index[student]]
+    
+    def get_student_comments(self, student):
+        return self.student_comments[self.student_index[student]]
+    
+    def get_student_level_codes(self, student):
+        return self.level_codes[:, self.student_index[student]]
+    
+    def get_student_color_codes(self, student):
+        return self.color_codes[:, self.student_index[student]]
+    
+    def get_generic_comment(self, i, level):
+        """ The generic comment for the i-th criterion at a given achievement level. """
+        return self.generic_comments[i, self.level_index[level]]
+
+
+class SharedActivityModel():
+    """ 
+    The students' points, achievement levels and comments of an activity in a 
+    memory-mapped file, together with the text of the rubric and the compiled report 
+    template, as returned by Evaluator.share_activity_model. 
+    
+    When pickled, only the name of the file, the names of the students and the 
+    (interned) text of the rubric are sent. The receiving process 
+    maps the file read-only when it first needs the data, so the arrays are shared 
+    by all processes instead of being copied into each of them. Arrays are stored 
+    with one row per student and one column per criterion.
+    
+    The file is deleted by close (or at the end of a with block), or otherwise when 
+    the model that created it is garbage collected.
+    """
+    def __init__(self, arrays, activity_number, students, criteria, point_texts, 
+                 level_labels, colored_level_labels, combined_generic_comments, colors, 
+                 str_reason_for_lowerscore, template, profile, directory = None):
+        self.activity_number = activity_number
+        self.students = tuple(students)
+        self.student_index = {student: j for j, student in enumerate(self.students)}
+        self.criteria = tuple(sys.intern(x) for x in criteria)
+        self.point_texts = point_texts
+        self.level_labels = level_labels
+        self.colored_level_labels = colored_level_labels
+        self.combined_generic_comments = tuple(
+            tuple(sys.intern(x) if isinstance(x, str) else x for x in comments) 
+            for comments in combined_generic_comments)
+        self.colors = tuple(colors)
+        self.str_reason_for_lowerscore = str_reason_for_lowerscore
+        self.template = template
+        self.profile = profile
+        
+        fd, self.filename = tempfile.mkstemp(prefix = "scores_", suffix = ".bin", dir = directory)
+        self.layout = {}
+        offset = 0
+        with os.fdopen(fd, "wb") as f:
+            for name, x in arrays.items():
+                # Align each array to 8 bytes, so that it can be mapped as is
+                offset += -offset % 8
+                f.seek(offset)
+                f.write(np.ascontiguousarray(x).tobytes())
+                self.layout[name] = (x.dtype.str, x.shape, offset)
+                offset += x.nbytes
+        self.owner = True
+        self.finalizer = weakref.finalize(self, os.remove, self.filename)
+        self.arrays = None
+    
+    def attach(self):
+        """ Maps the arrays from the file, unless they are already mapped. Returns them. """
+        if self.arrays is None:
+            self.arrays = {name: np.memmap(self.filename, dtype = dtype, mode = "r", 
+                                           shape = shape, offset = offset) 
+                           if np.prod(shape) > 0 else np.zeros(shape, dtype = dtype)
+                           for name, (dtype, shape, offset) in self.layout.items()}
+        return self.arrays
+    
+    def close(self):
+        """ Unmaps the arrays, and deletes the file if this is the model that created it. """
+        self.arrays = None
+        if self.owner and self.finalizer.alive:
+            self.finalizer()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["student_index"]
+        state.pop("finalizer", None)
+        state["arrays"] = None
+        state["owner"] = False
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.student_index = {student: j for j, student in enumerate(self.students)}
+    
+    def get_student_points(self, student):
+        return self.attach()["points"][self.student_index[student]]
+    
+    def get_student_level_codes(self, student):
+        return self.attach()["level_codes"][self.student_index[student]]
+    
+    def get_student_color_codes(self, student):
+        return self.attach()["color_codes"][self.student_index[student]]
+    
+    def get_student_comments(self, student):
+        """ The specific comments of a student, with None for criteria without a comment. """
+        arrays = self.attach()
+        j = self.student_index[student]
+        comments = arrays["comments"]
+        return [comments[start:(start + length)].tobytes().decode("utf-8") if length >= 0 else None 
+                for start, length in zip(arrays["comment_starts"][j], arrays["comment_lengths"][j])]
+    
+    def get_student_score_texts(self, student):
+        """ The points of a student, formatted as in the reports. """
+        arrays = self.attach()
+        j = self.student_index[student]
+        return [self.point_texts[(j, i)] if (j, i) in self.point_texts else 
+                str(int(x)) if is_integer else str(x) 
+                for i, (x, is_integer) in enumerate(zip(arrays["points"][j], arrays["integer_points"][j]))]
+    
+    def get_report_values(self, student):
+        """ As Evaluator.get_report_values. """
+        level_codes = self.get_student_level_codes(student)
+        color_codes = self.get_student_color_codes(student)
+        if (level_codes < 0).any():
+            raise AssertionError(f"Missing or out of range scores for {student} " + \
+                                 f"in activity {self.activity_number}.")
+        
+        generic_comments = [self.combined_generic_comments[i][level] 
+                            for i, level in enumerate(level_codes)]
+        if None in generic_comments:
+            raise AssertionError(f"Missing generic comments for the achievement levels of {student} " + \
+                                 f"in activity {self.activity_number}.")
+        
+        specific_comments = ["**" + self.str_reason_for_lowerscore + "**: " + comment 
+                             if comment is not None else "" 
+                             for comment in self.get_student_comments(student)]
+        return {
+            "student": [student], 
+            "level": [self.level_labels[level] for level in level_codes], 
+            "colored_level": [self.colored_level_labels[level][color] 
+                              for level, color in zip(level_codes, color_codes)], 
+            "color": [self.colors[color] for color in color_codes], 
+            "score": self.get_student_score_texts(student), 
+            "generic_comment": generic_comments, 
+            "specific_comment": specific_comments}
+    
+    def generate_report(self, student):
+        """ The report of a student as an EvaluationReport, as Evaluator.generate_report with export = False. """
+        return EvaluationReport(student, self.activity_number, self.criteria, 
+                                np.array(self.get_student_points(student)), 
+                                np.array(self.get_student_level_codes(student)), 
+                                self.get_report_values(student), self.template, self.profile)
+
+
+class ValidationReport():
+    """ 
+    Result of Evaluator.validate_scores. bad_cells and out_of_range hold 
+    (student, criterion, raw value) tuples, and ordering_mismatches holds 
+    (row, (category, criterion) in points, (category, criterion) in comments) tuples, 
+    with None for rows missing in one of the sections. merge_conflicts holds the 
+    cells of students that were filled in differently in several workbooks (see 
+    Evaluator.merge_student_columns); these students fail validation.
+    """
+    def __init__(self, activity_number, students, bad_cells, out_of_range, 
+                 ordering_mismatches, min_score, max_score, merge_conflicts = ()):
+        self.activity_number = activity_number
+        self.students = students
+        self.bad_cells = bad_cells
+        self.out_of_range = out_of_range
+        self.ordering_mismatches = ordering_mismatches
+        self.min_score = min_score
+        self.max_score = max_score
+        self.merge_conflicts = list(merge_conflicts)
+        self.failed_students = set(x[0] for x in bad_cells + out_of_range + self.merge_conflicts)
+    
+    def is_clean(self, student = None):
+        """ 
+        Whether a student's points (or if student is None, the whole activity) passed 
+        validation. The points and comments are matched by position, so if their rows 
+        don't match, no student passes.
+        """
+        if self.ordering_mismatches:
+            return False
+        if student is None:
+            return not self.failed_students
+        return student not in self.failed_students
+    
+    def get_failed_students(self):
+        return [student for student in self.students if not self.is_clean(student)]
+    
+    def __str__(self):
+        lines = [f"Validation of activity {self.activity_number}:"]
+        for student, criterion, value in self.bad_cells:
+            lines.append(f"  Missing or non-numeric score for {student}, {criterion}: {value!r}")
+        for student, criterion, value in self.out_of_range:
+            lines.append(f"  Score outside [{self.min_score}, {self.max_score}] for {student}, " + \
+                         f"{criterion}: {value!r}")
+        for i, points, comments in self.ordering_mismatches:
+            lines.append(f"  Row {i} of the points ({points}) doesn't match row {i} " + \
+                         f"of the comments ({comments})")
+        for student, criterion, value, other_value, filename in self.merge_conflicts:
+            lines.append(f"  Conflicting values for {student}, {criterion}: {value!r} in the " + \
+                         f"main workbook and {other_value!r} in {filename}")
+        if len(lines) == 1:
+            lines.append("  No problems found.")
+        return "\n".join(lines)
+
+
+class CohortSummary():
+    """ 
+    Result of Evaluator.cohort_summary. criterion_stats, category_stats and 
+    total_stats hold the distribution of the points on each criterion, the category 
+    averages and the weighted scores. level_counts holds the number of students at 
+    each achievement level on each criterion, and student_scores the category 
+    averages and weighted score of each student (one row per student).
+    """
+    def __init__(self, activity_number, students, criterion_stats, category_stats, 
+                 level_counts, student_scores, total_stats):
+        self.activity_number = activity_number
+        self.students = students
+        self.criterion_stats = criterion_stats
+        self.category_stats = category_stats
+        self.level_counts = level_counts
+        self.student_scores = student_scores
+        self.total_stats = total_stats
+
+
+def make_markdown_table(df, float_format = "{:.2f}"):
+    """ Formats a dataframe as a markdown table, with missing values shown as '-'. """
+    def format_value(x):
+        if isinstance(x, (float, np.floating)):
+            return "-" if np.isnan(x) else float_format.format(x)
+        return str(x)
+    
+    lines = ["|" + " | ".join([str(x) for x in df.columns]) + " |", 
+             "|" + " | ".join(["---"] * len(df.columns)) + " |"]
+    lines += ["|" + " | ".join([format_value(x) for x in row]) + " |" 
+              for row in df.itertuples(index = False)]
+    return "\n".join(lines)
+
+
+def read_only(x):
+    """ Copy of an array that can't be modified. """
+    x = np.array(x)
+    x.flags.writeable = False
+    return x
+
+
+class EvaluationReport():
+    """ 
+    The report of a student, as returned by Evaluator.generate_report. Holds the 
+    points and achievement level codes of each criterion, and the values that are 
+    filled into the report template (see Evaluator.get_report_values). The markdown, 
+    html and pdf are rendered when first accessed, and kept for later use. 
+    
+    When pickled, e.g. to be exported in a worker process, the report is sent as 
+    its markdown, points and level codes, without the template values, template 
+    and pdf.
+    """
+    __slots__ = ["student", "activity_number", "criteria", "points", "level_codes", 
+                 "values", "template", "profile", "rendered"]
+    
+    def __init__(self, student, activity_number, criteria, points, level_codes, values, 
+                 template, profile):
+        self.student = student
+        self.activity_number = activity_number
+        self.criteria = criteria
+        self.points = points
+        self.level_codes = level_codes
+        self.values = values
+        self.template = template
+        self.profile = profile
+        self.rendered = {}
+    
+    @classmethod
+    def from_markdown(cls, str_report, profile):
+        """ A report with only the given markdown, e.g. to export a combination of reports. """
+        report = cls(None, None, (), (), (), {}, None, profile)
+        report.rendered["md"] = str_report
+        return report
+    
+    @property
+    def markdown(self):
+        if "md" not in self.rendered:
+            self.rendered["md"] = self.template.render(self.values)
+        return self.rendered["md"]
+    
+    @property
+    def html(self):
+        if "html" not in self.rendered:
+            import markdown
+            self.rendered["html"] = markdown.markdown(self.markdown)
+        return self.rendered["html"]
+    
+    @property
+    def pdf(self):
+        """ The pdf as bytes. """
+        if "pdf" not in self.rendered:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                fn_pdf = os.path.join(tmpdir, "report.pdf")
+                self.profile.convert_to_pdf(self.markdown, fn_pdf)
+                with open(fn_pdf, "rb") as f:
+                    self.rendered["pdf"] = f.read()
+        return self.rendered["pdf"]
+    
+    def write_pdf(self, fn_pdf, profile = None):
+        """ Writes the pdf to fn_pdf, converting the markdown directly to the file unless the pdf has already been rendered. """
+        if "pdf" in self.rendered:
+            with open(fn_pdf, "wb") as f:
+                f.write(self.rendered["pdf"])
+        else:
+            (profile or self.profile).convert_to_pdf(self.markdown, fn_pdf)
+    
+    def __str__(self):
+        return self.markdown
+    
+    def __getstate__(self):
+        self.markdown
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["template"] = None
+        state["values"] = None
+        state["rendered"] = {fmt: x for fmt, x in self.rendered.items() if fmt != "pdf"}
+        return state
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def main(argv = None):
+    from rubric_cli import make_parser
+    run(make_parser().parse_args(argv))
+
+
+def run(args):
+    """ Runs the command line (see rubric_cli.py) with the parsed arguments. """
+    evaluator = Evaluator(args.filename, args.course_code, args.semester, 
+                          cache_dir = args.cache_dir, 
+                          timing = args.timing or args.trace is not None, 
+                          secondary_filenames = args.merge)
+    if args.watch:
+        evaluator.watch(args.activity_numbers or None, workers = args.workers, 
+                        batch = args.batch, formats = args.formats, 
+                        precompile = args.precompile)
+        return
+    for activity_number in (args.activity_numbers or evaluator.activity_numbers):
+        if args.validate:
+            print(evaluator.validate_scores(activity_number))
+            continue
+        if args.zip:
+            evaluator.generate_reports_zip(activity_number, workers = args.workers, 
+                                           formats = args.formats)
+            continue
+        if args.cohort:
+            evaluator.generate_cohort_report(activity_number, formats = args.formats)
+            continue
+        if args.cprofile is not None:
+            evaluator.profile_report(args.cprofile, activity_number, formats = args.formats)
+            continue
+        if args.timeout is not None:
+            evaluator.generate_reports_concurrently(activity_number, concurrency = args.workers, 
+                                                    timeout = args.timeout, force = args.force, 
+                                                    formats = args.formats, 
+                                                    precompile = args.precompile)
+            continue
+        evaluator.generate_reports(activity_number, workers = args.workers, batch = args.batch, 
+                                   force = args.force, formats = args.formats, 
+                                   precompile = args.precompile)
+    
+    if args.trace is not None:
+        evaluator.timer.write_trace(args.trace)
+
+
+if __name__ == "__main__":
+    main()
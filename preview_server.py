@@ -0,0 +1,203 @@
+"""
+Local web server for previewing the reports of students while grading. The
+workbook is loaded once, and the reports are rendered on demand:
+
+    python preview_server.py FAG123_H2019_vurdering.xlsx FAG123 H2019 --port 8000
+
+    http://localhost:8000/                                  list of students
+    http://localhost:8000/activity/3/student/<name>         report as html
+    http://localhost:8000/activity/3/student/<name>?format=pdf
+
+Reports are kept in a least recently used cache, keyed on a hash of the student's
+data, and each format is only rendered once, so repeated previews are instant. When
+the workbook is saved, the changed sheets are read again, and the reports of
+students whose data changed are rendered again on the next request. The pdf of a
+report is only compiled once, even if it is requested several times at once.
+"""
+import argparse
+import html
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+from evaluation_rubric import Evaluator
+
+
+class LRUCache():
+    """ A thread safe dictionary that holds at most maxsize items, dropping the least recently used. """
+    def __init__(self, maxsize = 128):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last = False)
+
+
+class ReportPreviewer():
+    """
+    Renders the reports of an Evaluator as html or pdf, caching the results (see
+    the module docstring). The Evaluator is only used by one thread at a time, while
+    pdfs are compiled in parallel.
+    """
+    content_types = {"html": "text/html; charset=utf-8",
+                     "pdf": "application/pdf",
+                     "md": "text/markdown; charset=utf-8"}
+
+    def __init__(self, evaluator, maxsize = 128):
+        self.evaluator = evaluator
+        self.cache = LRUCache(maxsize)
+        self.lock = threading.RLock()
+        self.rubric_hashes = {}
+        self.validations = {}
+        self.pdf_locks = {}
+        self.file_state = evaluator.get_file_state()
+        self.checksums = evaluator.get_sheet_checksums()
+
+    def check_workbook(self):
+        """ Reads the changed parts of the workbook again, if it has been saved. """
+        with self.lock:
+            state = self.evaluator.get_file_state()
+            if state == self.file_state:
+                return
+            changed, self.checksums = self.evaluator.reload_workbook(self.checksums)
+            self.file_state = state
+            self.rubric_hashes = {}
+            self.validations = {}
+            for activity_number, students in changed.items():
+                if students:
+                    print(f"CHANGED: {len(students)} student(s) in activity {activity_number}")
+
+    def get_report(self, activity_number, student, fmt = "html"):
+        """ The report of a student as bytes in the given format ("html", "pdf" or "md"). """
+        if fmt not in self.content_types:
+            raise AssertionError(f"Unknown format {fmt}. Supported formats are {list(self.content_types)}")
+
+        with self.lock:
+            self.check_workbook()
+            evaluator = self.evaluator
+            if activity_number not in evaluator.activity_numbers:
+                raise KeyError(f"No activity {activity_number} in {evaluator.filename}.")
+            if activity_number not in self.rubric_hashes:
+                self.rubric_hashes[activity_number] = evaluator.get_rubric_hash(activity_number)
+                self.validations[activity_number] = evaluator.validate_scores(activity_number)
+            if student not in list(evaluator.get_students(activity_number)):
+                raise KeyError(f"No student {student} in activity {activity_number}.")
+
+            key = (activity_number, student,
+                   evaluator.get_student_hash(student, activity_number,
+                                              self.rubric_hashes[activity_number]))
+            report = self.cache.get(key)
+            if report is None:
+                validation = self.validations[activity_number]
+                if not validation.is_clean(student):
+                    raise AssertionError(str(validation))
+                report = evaluator.generate_report(student, activity_number, export = False)
+                self.cache.put(key, report)
+            if fmt == "pdf":
+                pdf_lock = self.pdf_locks.setdefault(key, threading.Lock())
+
+        if fmt == "md":
+            return report.markdown.encode("utf-8")
+        if fmt == "html":
+            return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>" + html.escape(student) + \
+                    "</title></head><body>\n" + report.html + "\n</body></html>\n").encode("utf-8")
+
+        # The pdf is compiled outside the lock, so that several reports can be compiled at 
+        # once, while requests for the same report wait for the first one to compile it
+        try:
+            with pdf_lock:
+                return report.pdf
+        finally:
+            with self.lock:
+                self.pdf_locks.pop(key, None)
+
+    def get_index(self):
+        """ Html page with links to the reports of all students. """
+        with self.lock:
+            self.check_workbook()
+            parts = ["<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>",
+                     html.escape(self.evaluator.filename), "</title></head><body>\n"]
+            for activity_number in self.evaluator.activity_numbers:
+                parts.append(f"<h2>{html.escape(self.evaluator.str_activity)} {activity_number}</h2>\n<ul>\n")
+                for student in self.evaluator.get_students(activity_number):
+                    url = f"/activity/{activity_number}/student/{quote(student)}"
+                    parts.append(f"<li><a href=\"{url}\">{html.escape(student)}</a> " + \
+                                 f"(<a href=\"{url}?format=pdf\">pdf</a>)</li>\n")
+                parts.append("</ul>\n")
+            parts.append("</body></html>\n")
+        return "".join(parts).encode("utf-8")
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """ Serves the pages of the ReportPreviewer in self.server.previewer. """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(x) for x in url.path.strip("/").split("/")]
+        try:
+            if parts == [""]:
+                self.send_data(self.server.previewer.get_index(), "text/html; charset=utf-8")
+            elif len(parts) == 4 and parts[0] == "activity" and parts[2] == "student":
+                fmt = parse_qs(url.query).get("format", ["html"])[0]
+                if fmt not in ReportPreviewer.content_types:
+                    self.send_error(400, explain = f"Unknown format {fmt}.")
+                    return
+                data = self.server.previewer.get_report(int(parts[1]), parts[3], fmt)
+                self.send_data(data, ReportPreviewer.content_types[fmt])
+            else:
+                self.send_error(404)
+        except (KeyError, ValueError) as e:
+            self.send_error(404, explain = str(e))
+        except Exception as e:
+            self.send_error(500, explain = str(e))
+
+    def send_data(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(evaluator, host = "localhost", port = 8000, maxsize = 128):
+    """ Serves previews of the reports of an Evaluator until interrupted with Ctrl-C. """
+    server = ThreadingHTTPServer((host, port), PreviewRequestHandler)
+    server.previewer = ReportPreviewer(evaluator, maxsize = maxsize)
+    print(f"Serving report previews on http://{host}:{port}/. Press Ctrl-C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving report previews")
+    finally:
+        server.server_close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("filename", help = "Excel file containing the evaluation rubric(s).")
+    parser.add_argument("course_code", help = "Course code, e.g. FAG123.")
+    parser.add_argument("semester", help = "Semester, e.g. H2019.")
+    parser.add_argument("--host", default = "localhost")
+    parser.add_argument("--port", type = int, default = 8000)
+    parser.add_argument("--cache-size", type = int, default = 128,
+                        help = "Number of rendered reports to keep in memory.")
+    args = parser.parse_args(argv)
+
+    serve(Evaluator(args.filename, args.course_code, args.semester),
+          host = args.host, port = args.port, maxsize = args.cache_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Command line for generating evaluation reports. The arguments are parsed before
+evaluation_rubric (and with it pandas and numpy) is imported, so --help and
+mistyped arguments are answered immediately.
+
+    python rubric_cli.py FAG123_H2019_vurdering.xlsx FAG123 H2019 3 --workers 8
+"""
+import argparse
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description = "Generate evaluation reports from an evaluation rubric.")
+    parser.add_argument("filename", help = "Excel file containing the evaluation rubric(s).")
+    parser.add_argument("course_code", help = "Course code, e.g. FAG123.")
+    parser.add_argument("semester", help = "Semester, e.g. H2019.")
+    parser.add_argument("activity_numbers", nargs = "*", type = int, 
+                        help = "Activities to generate reports for. Defaults to all activities.")
+    parser.add_argument("--workers", type = int, default = 1, 
+                        help = "Number of worker processes used for pdf conversion.")
+    parser.add_argument("--batch", action = "store_true", 
+                        help = "Compile all reports for an activity in a single LaTeX run.")
+    parser.add_argument("--cache-dir", default = None, 
+                        help = "Folder in which to cache the parsed workbook between runs.")
+    parser.add_argument("--formats", nargs = "+", default = ["pdf"], choices = ["pdf", "html", "md"], 
+                        help = "Formats to export the reports to.")
+    parser.add_argument("--validate", action = "store_true", 
+                        help = "Only validate the scores, without generating reports.")
+    parser.add_argument("--precompile", action = "store_true", 
+                        help = "Precompile the LaTeX preamble once instead of loading it for every report.")
+    parser.add_argument("--force", action = "store_true", 
+                        help = "Regenerate all reports, also those that are up to date.")
+    parser.add_argument("--timeout", type = float, default = None, 
+                        help = "Run pandoc as subprocesses (at most --workers at a time), killing and "
+                               "retrying conversions that take longer than this many seconds.")
+    parser.add_argument("--zip", action = "store_true", 
+                        help = "Write the reports of each activity to a zip archive with a manifest, "
+                               "instead of a folder per student.")
+    parser.add_argument("--merge", nargs = "+", default = [], metavar = "WORKBOOK", 
+                        help = "Copies of the workbook filled in by other graders, whose students are added.")
+    parser.add_argument("--watch", action = "store_true", 
+                        help = "Keep watching the workbook, and update the reports of students whose data change.")
+    parser.add_argument("--cohort", action = "store_true", 
+                        help = "Only write the cohort summary for the instructor (with csv files).")
+    parser.add_argument("--timing", action = "store_true", 
+                        help = "Print the time spent in each stage after generating the reports.")
+    parser.add_argument("--trace", default = None, 
+                        help = "Write the timings to this file in the trace event format (implies --timing).")
+    parser.add_argument("--cprofile", default = None, metavar = "STUDENT", 
+                        help = "Only generate the report of this student, under cProfile.")
+    return parser
+
+
+def main(argv = None):
+    args = make_parser().parse_args(argv)
+    
+    from evaluation_rubric import run
+    run(args)
+
+
+if __name__ == "__main__":
+    main()